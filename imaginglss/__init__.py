@@ -26,6 +26,11 @@ class DECALS(object):
         sfdmap : :py:class:`imaginglss.model.sfdmap.SFDMap`
             The dust extinction object described by this configuration file.
 
+        comm : MPI.Comm or None
+            If set before datarelease is first used, the brick index and the
+            SFD maps are read once per node and shared by the ranks of comm
+            in MPI-3 shared memory. Requires mpi4py.
+
         Configuation File Format
         ------------------------
 
@@ -55,6 +60,26 @@ class DECALS(object):
         - dust_dir  : the location to look for dust map. for example
           /project/projectdirs/desi/software/edison/dust/v0_0/
 
+        The file may set the following variables:
+
+        - image_cache_size : the budget of the image cache in bytes,
+          per process. Cached images are read-only. The default is 0,
+          no cache; the MPI scripts enable it with --image-cache-size.
+
+        - use_pixel_cache : if True, images are read from the pixel
+          cache in decals_cache/pixels; the cache is filled as images
+          are used, or with imglss-mpi-build-pixel-cache.py.
+          The default is False.
+
+        - use_sfd_cache : if True, the SFD dust maps are converted to
+          .npy files in decals_cache/sfd and memory mapped.
+          The default is False.
+
+        - sfd_nside : if set, E(B-V) is looked up from a HEALPix table
+          at this nside, rather than interpolated from the SFD dust maps.
+          The table is built once and stored in decals_cache/sfd.
+          Requires healpy. The default is None.
+
     """
     def __init__(self, filename=None):
         if filename is None:
@@ -68,6 +93,10 @@ class DECALS(object):
         d['tycho_dir'] = os.environ.get("TYCHO_DIR", '.') 
         d['wise_dir'] = os.environ.get("WISE_DIR", '.') 
         d['decals_release'] = os.path.basename(d['decals_root']).upper()
+        d['image_cache_size'] = 0
+        d['use_pixel_cache'] = False
+        d['use_sfd_cache'] = False
+        d['sfd_nside'] = None
 
         if filename:
             # if a configuration file is specified.
@@ -87,15 +116,25 @@ class DECALS(object):
         self.dust_dir = d['dust_dir']
         self.tycho_dir = d['tycho_dir']
         self.wise_dir = d['wise_dir']
+        self.image_cache_size = d['image_cache_size']
+        self.use_pixel_cache = d['use_pixel_cache']
+        self.use_sfd_cache = d['use_sfd_cache']
+        self.sfd_nside = d['sfd_nside']
 
         self.filename = filename
+        self.comm = None
 
     @property
     def datarelease(self):
         if not hasattr(self, '_datarelease'):
             self._datarelease = DataRelease(root=self.decals_root, 
                 cache=self.cache_dir, version=self.decals_release,
-                dustdir=self.dust_dir)
+                dustdir=self.dust_dir,
+                image_cache_size=self.image_cache_size,
+                use_pixel_cache=self.use_pixel_cache,
+                use_sfd_cache=self.use_sfd_cache,
+                sfd_nside=self.sfd_nside,
+                comm=self.comm)
         return self._datarelease
 
     @property
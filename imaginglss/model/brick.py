@@ -74,7 +74,7 @@ class Brick(object):
         return ("Brick(id=%d, name=%s, area=%g, ra=%g, dec=%g, ...)"\
             % (self.id, self.name, self.area, self.ra, self.dec ))
 
-    def readout(self, coord, repo, default=numpy.nan):
+    def readout(self, coord, repo, default=numpy.nan, return_mask=False):
         """
         Return image values from an image repository.
 
@@ -86,11 +86,21 @@ class Brick(object):
             Image repository to read from. Refer to DataRelease.images.
         default : float
             Default value to return if the pixel is outside of the brick.
+        return_mask : boolean
+            If True, also return the mask of pixels that are inside the image.
 
         Returns
         -------
         values : array_like
             values read out from repo.
+        mask   : array_like
+            True for pixels inside the image; only if return_mask is True.
+
+        Notes
+        -----
+        A pixel is inside the image if 0 <= x < NAXIS1 and 0 <= y < NAXIS2.
+        Earlier versions compared x to NAXIS2 and y to NAXIS1, which
+        differs only for images that are not square.
 
         """
         coord     = numpy.array(coord)
@@ -98,15 +108,78 @@ class Brick(object):
         value     = numpy.empty(len(RA))
         value[...]= default
 
-        img   = repo.open(self)
-
         xy = numpy.round(self.query(repo, coord)).astype('int32')
-        mask = (xy < numpy.array(img.shape) \
-            .reshape(2, 1)).all(axis=0)
-        mask &= (xy >= 0).all(axis=0)
-        x, y= xy[:, mask]
-        value[mask] = img[y, x]
+        pixels, mask = repo.read_pixels(self, xy)
+        value[mask] = pixels
+        if return_mask:
+            return value, mask
         return value
+
+    def readout_many(self, coord, repos, default=numpy.nan, ignore_missing=False,
+            resolution=1, statistic='median', xy=None, shape=None):
+        """
+        Return image values from several image repositories.
+
+        All images of a brick share the same WCS; the pixel
+        coordinates are computed only once, from the first repository
+        that has an image of the brick.
+
+        Parameters
+        ----------
+        coord  : array_like
+            Coordinate of the pixels, coord=(RA, DEC)
+        repos  : list of :py:class:`~model.imagerepo.ImageRepo`
+            Image repositories to read from.
+        default : float
+            Default value to return if the pixel is outside of the brick.
+        ignore_missing : boolean
+            If True, missing images are marked in missing instead of
+            raising IOError.
+        resolution : int
+            If larger than 1, read from the images block downsampled
+            by this factor, reduced with statistic.
+            See :py:meth:`~model.imagerepo.ImageRepo.read_pixels`.
+        statistic : string
+            statistic of the downsampled images, e.g. 'min' or 'median'.
+        xy : array_like or None
+            the pixel coordinates of coord, if already known, e.g. from
+            a WCS table; None to compute them from the metadata.
+        shape : tuple or None
+            (ny, nx) of the images, if already known.
+
+        Returns
+        -------
+        values : array_like
+            (len(repos), N) values read out from repos.
+        mask   : array_like
+            (len(repos), N), True for pixels inside the image.
+        missing : array_like
+            (len(repos)), True for repositories without an image of the brick.
+
+        """
+        coord     = numpy.array(coord)
+        RA, DEC   = coord
+        values    = numpy.empty((len(repos), len(RA)))
+        values[...] = default
+        mask      = numpy.zeros(values.shape, dtype='?')
+        missing   = numpy.zeros(len(repos), dtype='?')
+
+        if xy is not None:
+            xy = numpy.round(xy).astype('int32')
+        for i, repo in enumerate(repos):
+            try:
+                if xy is None:
+                    xy = numpy.round(self.query(repo, coord)).astype('int32')
+                pixels, mask[i] = repo.read_pixels(self, xy,
+                        resolution=resolution, statistic=statistic,
+                        shape=shape)
+            except IOError:
+                if not ignore_missing:
+                    raise
+                missing[i] = True
+                continue
+            values[i][mask[i]] = pixels
+        return values, mask, missing
  
     def query(self, repo, coord):
         """
@@ -5,9 +5,14 @@ returning brick objects.
 
 """
 
+import os
+import json
+import shutil
 import numpy
 
+from ..utils import fits
 from .brick import Brick
+from .brickset import BrickSet
 
 __author__ = "Yu Feng and Martin White"
 __version__ = "1.0"
@@ -62,16 +67,159 @@ class BrickIndex(object):
         self.__dict__.update(state)
         self.init_from_state()
 
-    def init_from_state(self):
-        brickdata = self.brickdata
-        self.ncols = numpy.bincount(brickdata['BRICKROW'])
+    # arrays derived from brickdata that are saved in a snapshot.
+    SNAPSHOT_ARRAYS = ['brickdata', 'ncols', 'hash', 'AREA',
+        'rowkey_sortarg', 'rowkey_sorted', 'row_offsets', 'rowdec1', 'rowdec2',
+        'names_sortarg', 'names_sorted']
 
-        self.ROWMAX = brickdata['BRICKROW'].max()
-        self.COLMAX = brickdata['BRICKCOL'].max() 
+    # bump this if the content of a snapshot changes.
+    SNAPSHOT_VERSION = 1
 
-        # fast querying from row col
-        self.hash = brickdata['BRICKROW'] * (self.COLMAX + 1) +\
-                    brickdata['BRICKCOL']
+    @classmethod
+    def from_file(kls, filename, cachedir=None, comm=None):
+        """
+        Create a BrickIndex from a bricks file.
+
+        If cachedir is given, a binary snapshot of the index is
+        written to `cachedir/brickindex` on the first use, and later
+        calls memory-map the snapshot instead of decompressing and
+        indexing the FITS file again. The snapshot is rebuilt if
+        the size or the modification time of filename changes.
+
+        Parameters
+        ----------
+        filename : string
+            path to `bricks.fits`
+        cachedir : string or None
+            the cache directory of the data release.
+        comm : MPI.Comm or None
+            if given, only the first rank of comm on each node reads
+            the index; the arrays are shared by the ranks on the
+            node in MPI-3 shared memory. This is a collective
+            operation on comm.
+
+        """
+        if comm is not None:
+            return kls._from_file_shared(filename, cachedir, comm)
+
+        if cachedir is not None:
+            snapshot = os.path.join(cachedir, 'brickindex')
+            self = kls.__new__(kls)
+            if self.load_snapshot(snapshot, filename):
+                return self
+
+        brickdata = fits.read_table(filename)
+        self = kls(brickdata)
+
+        if cachedir is not None:
+            try:
+                self.save_snapshot(snapshot, filename)
+            except (IOError, OSError):
+                # the cache directory may be frozen.
+                pass
+        return self
+
+    def _snapshot_meta(self, filename):
+        st = os.stat(filename)
+        return dict(version=self.SNAPSHOT_VERSION,
+                    size=st.st_size,
+                    mtime=st.st_mtime)
+
+    def save_snapshot(self, path, filename):
+        """
+        Save the index to directory path as .npy files.
+
+        The snapshot is first written to a temporary directory then
+        moved into place, such that concurrent readers never see
+        a partial snapshot.
+
+        Parameters
+        ----------
+        path : string
+            the directory of the snapshot.
+        filename : string
+            the bricks file the index is built from.
+
+        """
+        meta = self._snapshot_meta(filename)
+        meta['ROWMAX'] = int(self.ROWMAX)
+        meta['COLMAX'] = int(self.COLMAX)
+
+        tmp = path + '.tmp-%d' % os.getpid()
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in self.SNAPSHOT_ARRAYS:
+            numpy.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as ff:
+            json.dump(meta, ff)
+
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process has written the snapshot first.
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def load_snapshot(self, path, filename):
+        """
+        Load the index from a snapshot at directory path; the arrays
+        are memory-mapped.
+
+        Returns
+        -------
+        success : boolean
+            False if the snapshot does not exist or is out of date
+            with respect to filename.
+
+        """
+        try:
+            with open(os.path.join(path, 'meta.json'), 'r') as ff:
+                meta = json.load(ff)
+            expected = self._snapshot_meta(filename)
+            for key in expected:
+                if meta.get(key) != expected[key]:
+                    return False
+
+            snapshot = {}
+            for name in self.SNAPSHOT_ARRAYS:
+                snapshot[name] = numpy.load(os.path.join(path, name + '.npy'),
+                        mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return False
+
+        self.ROWMAX = meta['ROWMAX']
+        self.COLMAX = meta['COLMAX']
+        self.brickdata = snapshot.pop('brickdata')
+        self.init_from_state(snapshot)
+        return True
+
+    @classmethod
+    def _from_file_shared(kls, filename, cachedir, comm):
+        """ from_file on the first rank of each node; the other ranks
+            map the arrays in shared memory.
+        """
+        from ..utils import mpishare
+
+        private = []
+        def load(name):
+            # only called on the first rank of each node.
+            if len(private) == 0:
+                private.append(kls.from_file(filename, cachedir))
+            return getattr(private[0], name)
+
+        snapshot = {}
+        for name in kls.SNAPSHOT_ARRAYS:
+            snapshot[name] = mpishare.share(comm, lambda name=name: load(name))
+
+        self = kls.__new__(kls)
+        self.brickdata = snapshot.pop('brickdata')
+        self.ROWMAX = len(snapshot['ncols']) - 1
+        self.COLMAX = self.brickdata['BRICKCOL'].max()
+        self.init_from_state(snapshot)
+        return self
+
+    def init_from_state(self, snapshot=None):
+        brickdata = self.brickdata
 
         self.RA = self.brickdata['RA']
         self.DEC = self.brickdata['DEC']
@@ -82,6 +230,36 @@ class BrickIndex(object):
 
         self.cache = {}
 
+        if snapshot is not None:
+            self.__dict__.update(snapshot)
+            return
+
+        self.ncols = numpy.bincount(brickdata['BRICKROW'])
+
+        self.ROWMAX = brickdata['BRICKROW'].max()
+        self.COLMAX = brickdata['BRICKCOL'].max() 
+
+        # fast querying from row col
+        self.hash = brickdata['BRICKROW'] * (self.COLMAX + 1) +\
+                    brickdata['BRICKCOL']
+
+        deg = numpy.pi / 180.
+        self.AREA = (numpy.sin(self.DEC2 * deg) \
+            - numpy.sin(self.DEC1 * deg)) * (self.RA2 - self.RA1) * deg \
+            * 129600 / numpy.pi / (4 * numpy.pi)
+
+        # row banded index for region queries; within a DEC row
+        # bricks are ordered by RA1.
+        brickrow = brickdata['BRICKROW']
+        rowkey = brickrow * 360. + self.RA1
+        self.rowkey_sortarg = rowkey.argsort(kind='mergesort')
+        self.rowkey_sorted = rowkey[self.rowkey_sortarg]
+        self.row_offsets = numpy.concatenate([[0], self.ncols.cumsum()])
+        self.rowdec1 = numpy.full(len(self.ncols), numpy.inf)
+        self.rowdec2 = numpy.full(len(self.ncols), -numpy.inf)
+        numpy.minimum.at(self.rowdec1, brickrow, self.DEC1)
+        numpy.maximum.at(self.rowdec2, brickrow, self.DEC2)
+
         self.names_sortarg = self.brickdata['BRICKNAME'].argsort()
         self.names_sorted = self.brickdata['BRICKNAME'][self.names_sortarg]
 
@@ -131,7 +309,7 @@ class BrickIndex(object):
         The lack of a vector version is on purpose to emphasize
         we are dealing with objects. 
 
-        Use :py:meth:`get_bricks` to create a list of objects.
+        Use :py:meth:`get_bricks` to create a set of bricks.
 
         """
         if index not in self.cache:
@@ -150,7 +328,7 @@ class BrickIndex(object):
 
     def get_bricks(self, indices):
         """
-        Obtain a list of bricks.
+        Obtain a set of bricks.
 
         Parameters
         ----------
@@ -159,33 +337,44 @@ class BrickIndex(object):
 
         Returns
         -------
-        bricks  : list
-            A list of bricks.
+        bricks  : :py:class:`~model.brickset.BrickSet`
+            A set of bricks. Brick objects are only created
+            when the set is indexed by an integer or iterated.
 
         """ 
-        return [self.get_brick(i) for i in indices]
+        return BrickSet(self, indices)
 
-    def search_by_name(self, brickname):
+    def search_by_name(self, brickname, return_missing=False):
         """
         Search the brickindex for bricks with a given name.
 
         Parameters
         ----------
-        brickname : string
-            the matching BRICKNAME.
+        brickname : string or array_like
+            the matching BRICKNAME or list of BRICKNAMEs.
+        return_missing : boolean
+            if True, also returns a mask of names that are not found.
 
         Returns
         -------
-        index  : integer
-            The internal index of bricks.
+        index  : integer or array_like
+            The internal index of bricks. The index of a missing
+            name is undefined.
+        missing : boolean or array_like
+            True for names that are not in the brickindex; only
+            returned if return_missing is True.
 
-        Notes
-        -----
-        This function is not vectorized.
         """
-        foo = numpy.empty(1, self.brickdata['BRICKNAME'].dtype)
-        foo[0] = brickname
-        bid = self.names_sortarg[self.names_sorted.searchsorted(foo[0])]
+        brickname = numpy.asarray(brickname)
+        key = brickname.astype(self.names_sorted.dtype)
+        ind = self.names_sorted.searchsorted(key)
+        ind = ind.clip(0, len(self.names_sorted) - 1)
+        # names longer than BRICKNAME are truncated by astype.
+        missing = self.names_sorted[ind] != key
+        missing |= numpy.char.str_len(key) != numpy.char.str_len(brickname)
+        bid = self.names_sortarg[ind]
+        if return_missing:
+            return bid, missing
         return bid
  
     def search_by_id(self, brickid):
@@ -241,6 +430,64 @@ class BrickIndex(object):
         ind = self.hash.searchsorted(hash)
         return ind
 
+    def query_neighbours(self, index):
+        """
+        Returns the internal index of bricks adjacent to bricks.
+
+        The neighbours are the two bricks on the same DEC row, and 
+        the bricks on the neighbouring rows that overlap with the
+        RA range of the brick.
+
+        Parameters
+        ----------
+        index  : array_like
+            internal index of bricks, vectorized.
+
+        Returns
+        -------
+        neighbours : array_like
+            (len(index), K) array of internal indices of neighbours.
+            Unused entries are -1. K depends on the bricks that
+            are queried.
+
+        """
+        index = numpy.asarray(index)
+        row = self.brickdata['BRICKROW'][index]
+        col = self.brickdata['BRICKCOL'][index]
+        ncols = self.ncols[row]
+        RA1 = self.RA1[index]
+        RA2 = self.RA2[index]
+
+        neighbours = []
+        for dc in [-1, 1]:
+            hash = row * (self.COLMAX + 1) + (col + dc) % ncols
+            neighbours.append(self.hash.searchsorted(hash).reshape(-1, 1))
+
+        for dr in [-1, 1]:
+            valid = (row + dr >= 0) & (row + dr <= self.ROWMAX)
+            row1 = (row + dr).clip(0, self.ROWMAX)
+            ncols1 = self.ncols[row1]
+            col1 = numpy.int32(numpy.floor(RA1 * ncols1 / 360.))
+            col2 = numpy.int32(numpy.floor(RA2 * ncols1 / 360.))
+            width = (col2 - col1).max() + 1 if len(index) else 0
+            col = col1[:, None] + numpy.arange(width)[None, :]
+            valid = valid[:, None] & (col <= col2[:, None])
+            hash = row1[:, None] * (self.COLMAX + 1) + col % ncols1[:, None]
+            ind = self.hash.searchsorted(hash)
+            ind[~valid] = -1
+            neighbours.append(ind)
+
+        neighbours = numpy.concatenate(neighbours, axis=1)
+
+        # near the poles a row may have very few bricks; 
+        # remove the brick itself and the duplicates.
+        neighbours[neighbours == index[:, None]] = -1
+        neighbours.sort(axis=1)
+        neighbours[:, 1:][neighbours[:, 1:] == neighbours[:, :-1]] = -1
+        neighbours.sort(axis=1)
+        K = (neighbours >= 0).sum(axis=1).max() if len(index) else 0
+        return neighbours[:, neighbours.shape[1] - K:]
+
     def query(self, coord):
         """ 
         Returns a brick at coord=(RA,DEC) in decimal degrees.  
@@ -257,7 +504,7 @@ class BrickIndex(object):
 
     def query_region(self, extent):
         """ 
-        Returns a list of bricks covering the extent in decimal degrees.  
+        Returns a set of bricks covering the extent in decimal degrees.  
 
         Parameters
         ----------
@@ -268,18 +515,50 @@ class BrickIndex(object):
         -----
         RA1 is the left side and RA2 is the right side. 
 
+        Only the DEC rows overlapping the extent are visited;
+        within a row the bricks are located by a binary search on RA.
+
         """
         RA1, RA2, DEC1, DEC2 = extent
 
         RA2 = (RA2 - RA1) % 360.
-        RA1B = (self.brickdata['RA1'] - RA1) % 360.
-        RA2B = (self.brickdata['RA2'] - RA1) % 360.
-        mask  = self.brickdata['DEC1'] <= DEC2
-        mask &= self.brickdata['DEC2'] >= DEC1
+
+        # only look at DEC rows overlapping the extent
+        rows = ((self.rowdec1 <= DEC2) & (self.rowdec2 >= DEC1)).nonzero()[0]
+
+        # RA1 of the candidates are in [RA1, RA1 + RA2] modulo 360.
+        # The range is padded, and refined with the exact test below.
+        eps = 1e-9
+        lo = RA1 % 360. - eps
+        hi = RA1 % 360. + RA2 + eps
+        intervals = [(max(lo, 0.), min(hi, 360.))]
+        if lo < 0:
+            intervals.append((lo + 360., 360.))
+        if hi > 360.:
+            intervals.append((0., hi - 360.))
+
+        rowstart = self.row_offsets[rows]
+        rowend = self.row_offsets[rows + 1]
+        ind = []
+        for l, h in intervals:
+            start = self.rowkey_sorted.searchsorted(rows * 360. + l, side='left')
+            end = self.rowkey_sorted.searchsorted(rows * 360. + h, side='right')
+            start = start.clip(rowstart, rowend)
+            end = end.clip(start, rowend)
+            length = end - start
+            offset = numpy.repeat(start - (length.cumsum() - length), length)
+            ind.append(self.rowkey_sortarg[numpy.arange(length.sum()) + offset])
+
+        ind = numpy.unique(numpy.concatenate(ind))
+
+        RA1B = (self.RA1[ind] - RA1) % 360.
+        RA2B = (self.RA2[ind] - RA1) % 360.
+        mask  = self.DEC1[ind] <= DEC2
+        mask &= self.DEC2[ind] >= DEC1
         mask &= RA1B <= RA2
         mask &= RA2B >= 0
-        ind = mask.nonzero()[0]
-        return [self.get_brick(i) for i in ind]
+        ind = ind[mask]
+        return self.get_bricks(ind)
 
     def optimize(self, coord, return_index=False, return_inverse=False):
         """
@@ -314,11 +593,9 @@ class BrickIndex(object):
         """
         coord = numpy.array(coord)
         bid = self.query_internal(coord)
-        arg = bid.argsort()
+        arg, invarg, offsets = self.bucket(bid)
         #
         if return_inverse:
-            invarg = numpy.empty_like(arg)
-            invarg[arg] = numpy.arange(len(arg), dtype='i8')
             if return_index:
                 return numpy.array(coord[:, arg]), arg, invarg
             else:
@@ -329,4 +606,92 @@ class BrickIndex(object):
             else:
                 return numpy.array(coord[:, arg])
 
+    def bucket(self, bid):
+        """
+        Group items by their bricks.
+
+        This is a stable sort on the internal index of bricks.
+        Items that are already grouped by bricks (e.g. from
+        :py:meth:`Footprint.random_sample`) are sorted with a merge sort,
+        which is linear on runs of sorted items. Otherwise the items are
+        sorted with a radix sort of 16 bit digits (numpy >= 1.17 counts
+        the digits; older versions use a merge sort per digit).
 
+        Parameters
+        ----------
+        bid    : array_like
+            internal index of the brick of each item, e.g. from 
+            :py:meth:`query_internal`.
+
+        Returns
+        -------
+        arg     : array_like
+            bid[arg] is sorted.
+        invarg  : array_like
+            arg[invarg] == arange(len(bid)); use it to scatter values
+            of sorted items back to the original ordering.
+        offsets : array_like
+            CSR offsets keyed by the internal index of bricks, of
+            length len(self) + 1. Items in brick i are
+            arg[offsets[i]:offsets[i + 1]].
+
+        """
+        bid = numpy.asarray(bid)
+        counts = numpy.bincount(bid, minlength=len(self))
+        offsets = numpy.zeros(len(counts) + 1, dtype='i8')
+        counts.cumsum(out=offsets[1:])
+
+        # mergesort is a timsort for 64 bit integers; it is fast on
+        # runs that are already sorted. kind='stable' requires numpy >= 1.15.
+        ndescents = numpy.count_nonzero(bid[1:] < bid[:-1])
+        if ndescents * 16 < len(bid):
+            arg = bid.argsort(kind='mergesort')
+        else:
+            # numpy >= 1.17 sorts 8 and 16 bit integers with a radix sort;
+            # one pass per digit, least significant first. Gathering the
+            # digits is cheaper than gathering bid.
+            nbits = max(int(len(self)).bit_length(), 1)
+            arg = None
+            for shift in range(0, nbits, 16):
+                digit = (bid >> shift).astype('u1' if nbits - shift <= 8 else 'u2')
+                if arg is None:
+                    arg = digit.argsort(kind='mergesort')
+                else:
+                    arg = arg[digit[arg].argsort(kind='mergesort')]
+
+        invarg = numpy.empty_like(arg)
+        invarg[arg] = numpy.arange(len(arg), dtype='i8')
+        return arg, invarg, offsets
+
+if __name__ == '__main__':
+    # self test on a synthetic grid of bricks, laid out as in DECALS.
+    rows = []
+    for row in range(721):
+        dec = (row - 360) / 4.
+        dec1, dec2 = max(dec - 0.125, -90.), min(dec + 0.125, 90.)
+        ncols = max(1, int(1440 * numpy.cos(dec * numpy.pi / 180) + 0.5))
+        for col in range(ncols):
+            ra1, ra2 = col * 360. / ncols, (col + 1) * 360. / ncols
+            rows.append(('%04d%s%03d' % ((ra1 + ra2) * 5, 'p' if dec >= 0 else 'm', abs(dec) * 10),
+                len(rows) + 1, row, col, (ra1 + ra2) * 0.5, dec, ra1, ra2, dec1, dec2))
+    brickdata = numpy.array(rows, dtype=[('BRICKNAME', 'S8'), ('BRICKID', 'i4'),
+        ('BRICKROW', 'i4'), ('BRICKCOL', 'i4'), ('RA', 'f8'), ('DEC', 'f8'),
+        ('RA1', 'f8'), ('RA2', 'f8'), ('DEC1', 'f8'), ('DEC2', 'f8')])
+    bi = BrickIndex(brickdata)
+
+    rng = numpy.random.RandomState(1234)
+    coord = (rng.uniform(0, 360., size=100000), rng.uniform(-90, 90., size=100000))
+    bid = bi.query_internal(coord)
+
+    # random items, items grouped by bricks and grouped items in
+    # a shuffled order of bricks.
+    grouped = numpy.sort(bid)
+    ubid, first = numpy.unique(grouped, return_index=True)
+    shuffled = numpy.concatenate(numpy.split(grouped, first[1:])[::-1])
+    for bid in [bid, grouped, shuffled]:
+        arg, invarg, offsets = bi.bucket(bid)
+        assert (arg == bid.argsort(kind='mergesort')).all()
+        assert (arg[invarg] == numpy.arange(len(bid))).all()
+        assert (offsets[1:] == numpy.bincount(bid, minlength=len(bi)).cumsum()).all()
+        assert offsets[0] == 0 and len(offsets) == len(bi) + 1
+    print('bucket: ok')
@@ -0,0 +1,105 @@
+"""
+Python code to represent a set of bricks as columns of arrays,
+rather than a list of :py:class:`~model.brick.Brick` objects.
+
+"""
+import numpy
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+
+class BrickSet(object):
+    """
+    A set of bricks, stored as a struct of arrays.
+
+    The columns are views into the tables of a
+    :py:class:`~model.brickindex.BrickIndex`; only the internal
+    indices of the bricks are stored. Brick objects are created
+    on demand when the BrickSet is indexed by an integer or iterated.
+
+    A BrickSet is usually created by
+    :py:meth:`~model.brickindex.BrickIndex.get_bricks`.
+
+    Attributes
+    ----------
+    index   :   array_like
+        Internal index used by :py:class:`~model.brickindex.BrickIndex`
+    id   :   array_like
+        ID of the bricks as in the Tractor catalogue.
+    name : array_like
+        name of the bricks as in the Tractor catalogue.
+    ra, dec : array_like
+        center coordinates of the bricks
+    ra1, ra2, dec1, dec2 : array_like
+        min and max coordinates of the bricks
+    area : array_like
+        area of the bricks in square degrees
+
+    """
+    def __init__(self, brickindex, indices):
+        """
+        Parameters
+        ----------
+        brickindex : :py:class:`~model.brickindex.BrickIndex`
+            the brick index that owns the bricks.
+        indices : array_like
+            internal indices of the bricks.
+
+        """
+        self.brickindex = brickindex
+        self.index = numpy.asarray(indices, dtype='i8').reshape(-1)
+
+    @property
+    def id(self):
+        return self.brickindex.brickdata['BRICKID'][self.index]
+
+    @property
+    def name(self):
+        return self.brickindex.brickdata['BRICKNAME'][self.index]
+
+    @property
+    def ra(self):
+        return self.brickindex.RA[self.index]
+
+    @property
+    def dec(self):
+        return self.brickindex.DEC[self.index]
+
+    @property
+    def ra1(self):
+        return self.brickindex.RA1[self.index]
+
+    @property
+    def ra2(self):
+        return self.brickindex.RA2[self.index]
+
+    @property
+    def dec1(self):
+        return self.brickindex.DEC1[self.index]
+
+    @property
+    def dec2(self):
+        return self.brickindex.DEC2[self.index]
+
+    @property
+    def area(self):
+        return self.brickindex.AREA[self.index]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        """ An integer returns a Brick object; a slice or an array
+            returns a new BrickSet.
+        """
+        if numpy.isscalar(index):
+            return self.brickindex.get_brick(self.index[index])
+        return BrickSet(self.brickindex, self.index[index])
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.brickindex.get_brick(i)
+
+    def __repr__(self):
+        return "BrickSet(len=%d, area=%g)" % (len(self), self.area.sum())
@@ -13,11 +13,18 @@ import os.path
 import numpy
 import glob
 import re
+import json
+import zipfile
 from collections import namedtuple
 
 from ..utils import fits
+from ..utils import dirscan
+from ..utils import wcs_tangent
 
 from . import brickindex
+from .brickset import BrickSet
+from .healpixindex import HealpixIndex
+from .imagecache import ImageCache
 from . import imagerepo
 from . import catalogue
 from . import schema
@@ -87,8 +94,8 @@ class Footprint(object):
 
         Attributes
         ----------
-        bricks : list of model.brick.Brick
-            A list of Bricks that are covered by the footprint
+        bricks : :py:class:`~model.brickset.BrickSet`
+            The set of Bricks that are covered by the footprint
         range :  tuple
             The range of RA and DEC of all bricks
             (ramin, ramax, decmin, decmax)
@@ -96,20 +103,23 @@ class Footprint(object):
             Covered outline area in square degrees
     """
     def __init__(self, bricks, brickindex):
+        if not isinstance(bricks, BrickSet):
+            # a list of Brick objects.
+            bricks = brickindex.get_bricks([b.index for b in bricks])
+
         self.bricks = bricks 
-        self.area = sum([b.area for b in bricks])
-        self._covered_brickids = numpy.array(
-                    [b.index for b in bricks], dtype='i8')
+        self.area = bricks.area.sum()
+        self._covered_brickids = bricks.index
 
         # range of ra dec of covered bricks
         FootPrintRange = namedtuple('FootPrintRange', ['ramin', 'ramax', 'decmin', 'decmax', 'area'])
         if len(bricks) == 0:
             self.range = FootPrintRange(ramin=0, ramax=0, decmin=0, decmax=0, area=0)
         else:
-            ramin=min([brick.ra1 for brick in self.bricks])
-            ramax=max([brick.ra2 for brick in self.bricks])
-            decmin=min([brick.dec1 for brick in self.bricks])
-            decmax=max([brick.dec2 for brick in self.bricks])
+            ramin=bricks.ra1.min()
+            ramax=bricks.ra2.max()
+            decmin=bricks.dec1.min()
+            decmax=bricks.dec2.max()
             deg = numpy.pi / 180.
             self.range = FootPrintRange(
                 ramin=ramin, ramax=ramax,decmin=decmin,decmax=decmax,
@@ -119,6 +129,40 @@ class Footprint(object):
                 )
 
         self.brickindex = brickindex
+        self._brickmask = None
+
+    @property
+    def brickmask(self):
+        """ A boolean array over all bricks in the brickindex, True for
+            bricks in the footprint. Built on the first use; 
+            use it to test if bricks are in the footprint with a single gather.
+        """
+        if self._brickmask is None:
+            brickmask = numpy.zeros(len(self.brickindex), dtype='?')
+            brickmask[self._covered_brickids] = True
+            self._brickmask = brickmask
+        return self._brickmask
+
+    def covers(self, bid):
+        """ Test if bricks are in the footprint.
+
+            Parameters
+            ----------
+            bid : array_like
+                internal index of bricks, e.g. from
+                :py:meth:`~model.brickindex.BrickIndex.query_internal`.
+                Indices out of range (-1, or len(brickindex) for RA >= 360
+                on the top row) are not in the footprint.
+
+            Returns
+            -------
+            mask : array_like
+                True for bricks in the footprint.
+        """
+        brickmask = self.brickmask
+        bid = numpy.asarray(bid)
+        valid = (bid >= 0) & (bid < len(brickmask))
+        return brickmask[bid.clip(0, len(brickmask) - 1)] & valid
 
     def __len__(self):
         return len(self.bricks)
@@ -133,24 +177,40 @@ class Footprint(object):
                 str(self.range)
             )
 
+    def _combine(self, other, op):
+        # the brick masks are dense, thus the result is sorted.
+        ind = op(self.brickmask, other.brickmask).nonzero()[0]
+        return Footprint(self.brickindex.get_bricks(ind), self.brickindex)
+
     def intersect(self, other):
-        """ Returns the intersection with another footprint. """
-        bricks = list(set(self.bricks).intersection(set(other.bricks)))
-        return Footprint(bricks, self.brickindex)
+        """ Returns the intersection with another footprint. 
+            Bricks of the result are sorted. """
+        return self._combine(other, numpy.logical_and)
 
     def union(self, other):
-        """ Returns the union with another footprint. """
-        bricks = list(set(self.bricks + other.bricks))
-        return Footprint(bricks, self.brickindex)
+        """ Returns the union with another footprint.
+            Bricks of the result are sorted. """
+        return self._combine(other, numpy.logical_or)
+
+    def difference(self, other):
+        """ Returns the bricks that are not in another footprint.
+            Bricks of the result are sorted. """
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def symmetric_difference(self, other):
+        """ Returns the bricks that are in either but not both footprints.
+            Bricks of the result are sorted. """
+        return self._combine(other, numpy.logical_xor)
 
     def random_sample(self, Npoints, rng):
         """
         Generate uniformly distributed points within the boundary that lie in
         the footprint.
         
-        The random points are generated by first producing random points with
-        int the ra and dec range of the footprint, then remove
-        points that are not in any bricks.
+        The number of points in each brick is drawn from a multinomial
+        distribution with probabilities proportional to the area of the
+        bricks. The points are then generated uniformly on the sphere
+        within the RA and DEC range of each brick.
 
         Parameters
         ----------
@@ -167,40 +227,60 @@ class Footprint(object):
 
         Notes
         -----
-        Internally, the random points are generated in batches of 1 million points.
+        Internally, the random points are generated in batches of bricks with 
+        about 1 million points. The points are grouped by bricks.
 
-        If the footprint is sparse in the bounding ra, dec range, this algorithm
-        becomes extremely inefficient.
+        The cost scales with the number of points, regardless of how sparse
+        the footprint is in the bounding ra, dec range.
 
         """
 
         coord = numpy.empty((2, Npoints))
+        if Npoints == 0:
+            return coord
+
+        area = self.bricks.area
+        counts = rng.multinomial(Npoints, area / area.sum())
+        offsets = numpy.concatenate([[0], counts.cumsum()])
+
+        ra1 = self.bricks.ra1
+        ra2 = self.bricks.ra2
+        cmin = numpy.sin(self.bricks.dec1 * numpy.pi / 180)
+        cmax = numpy.sin(self.bricks.dec2 * numpy.pi / 180)
 
-        ramin,ramax,dcmin,dcmax,area = self.range
-        Nmake = int(area / self.area * Npoints)
         start = 0
-        while start != Npoints:
-            u1,u2= rng.uniform(size=(2, min([Nmake, 1024 * 1024])) )
+        while start != len(counts):
+            end = offsets.searchsorted(offsets[start] + 1024 * 1024, side='right') - 1
+            end = min(max(end, start + 1), len(counts))
+            n = counts[start:end]
+
+            u1,u2= rng.uniform(size=(2, n.sum()))
 
             #
-            cmin = numpy.sin(dcmin*numpy.pi/180)
-            cmax = numpy.sin(dcmax*numpy.pi/180)
-            #
-            RA   = ramin + u1*(ramax-ramin)
-            DEC  = 90-numpy.arccos(cmin+u2*(cmax-cmin))*180./numpy.pi
-            # Filter out those not in any bricks: only very few points remain
-            coord1 = self.filter((RA, DEC))
-
-            # Are we full?
-            coord1 = coord1[:, :min(len(coord1.T), Npoints - start)]
-            sl = slice(start, start + len(coord1.T))
-            coord[:, sl] = coord1
-            start = start + len(coord1.T)
-            Nmake = int(area / self.area * (Npoints - start) + 1)
-            
+            RA   = numpy.repeat(ra1[start:end], n)
+            RA  += u1 * numpy.repeat(ra2[start:end] - ra1[start:end], n)
+            c    = numpy.repeat(cmin[start:end], n)
+            c   += u2 * numpy.repeat(cmax[start:end] - cmin[start:end], n)
+            DEC  = 90-numpy.arccos(c)*180./numpy.pi
+
+            sl = slice(offsets[start], offsets[end])
+            coord[0, sl] = RA
+            coord[1, sl] = DEC
+            start = end
+
         return coord
 
-        
+    def healpix_coverage(self, hpindex):
+        """ Returns a HEALPix map of the fraction of each pixel covered by
+            the footprint.
+
+            Parameters
+            ----------
+            hpindex : :py:class:`~model.healpixindex.HealpixIndex`
+                created with :py:meth:`DataRelease.get_healpix_index`
+        """
+        return hpindex.coverage(self._covered_brickids)
+
     def filter(self, coord):
         """ Remove coordinates that are not covered by the footprint 
 
@@ -217,7 +297,7 @@ class Footprint(object):
         """
         coord = numpy.array(coord)
         bid = self.brickindex.query_internal(coord)
-        mask = contains(self._covered_brickids, bid)
+        mask = self.covers(bid)
         return coord[:, mask]
 
 class DataRelease(object):
@@ -230,7 +310,10 @@ class DataRelease(object):
     ----------
 
     brickindex : :py:class:`~model.brickindex.BrickIndex`
-        an index object of all of the bricks (covering the entire sky)
+        an index object of all of the bricks (covering the entire sky).
+        If comm is given in the constructor, the brick index and the
+        SFD maps are read by one rank per node and shared by the ranks
+        on the node in MPI-3 shared memory.
     bands      : dict
         a dictionary translating from band name to integer used in Tractor catalogue
     catalogue  : :py:class:`~model.catalogue.CachedCatalogue`
@@ -244,6 +327,19 @@ class DataRelease(object):
         py:meth:`readout`.
     footprint  : :py:class:`Footprint`
         the footprint of the data release.
+    image_cache : :py:class:`~model.imagecache.ImageCache`
+        the cache of images shared by all image repositories.
+        The cache is off by default, and every read goes to the
+        image files; pass image_cache_size, the budget in bytes per
+        process, to the constructor to enable it.
+    use_pixel_cache : boolean
+        if True, the image repositories read from the pixel cache
+        at `cache/pixels`; see :py:class:`~model.imagerepo.ImageRepo`.
+    sfdmap     : :py:class:`~model.sfdmap.SFDMap`
+        the SFD98 dust map. If use_sfd_cache is True in the constructor,
+        the maps are memory mapped from `cache/sfd`.
+        With sfd_nside, E(B-V) is looked up from a HEALPix table at sfd_nside,
+        which is stored in `cache/sfd`.
 
     Examples
     --------
@@ -254,13 +350,23 @@ class DataRelease(object):
 
 
     """
-    def __init__(self, root, cache, version, dustdir):
+    def __init__(self, root, cache, version, dustdir, image_cache_size=0,
+            use_pixel_cache=False, use_sfd_cache=False, sfd_nside=None, comm=None):
         root = os.path.normpath(root)
 
         self.root = root
         self.cache = cache
-
-        self.sfdmap = SFDMap(dustdir=dustdir)
+        self.image_cache_size = image_cache_size
+        self.use_pixel_cache = use_pixel_cache
+
+        # the HEALPix tables of E(B-V) are always stored in the cache;
+        # the maps only if use_sfd_cache.
+        sfdcache = os.path.join(cache, 'sfd')
+        self.sfdmap = SFDMap(dustdir=dustdir,
+                cachedir=sfdcache if use_sfd_cache else None,
+                nside=sfd_nside, tabledir=sfdcache)
+        if comm is not None:
+            self.sfdmap.share(comm)
 
         if not hasattr(schema, version):
             raise KeyError("Data Release of version %s is not supported" % version)
@@ -276,9 +382,9 @@ class DataRelease(object):
 
         self.bands = {'u':0, 'g':1, 'r':2, 'i':3, 'z':4, 'Y':5}
 
-        brickdata = fits.read_table(os.path.join(self.root, myschema.BRICKS_FILENAME))
-
-        self.brickindex = brickindex.BrickIndex(brickdata)
+        self.brickindex = brickindex.BrickIndex.from_file(
+                os.path.join(self.root, myschema.BRICKS_FILENAME),
+                cachedir=self.cache, comm=comm)
 
         # E(B-V) to ugrizY bands, SFD98; used in tractor
         self.extinction = numpy.array([3.995, 3.214, 2.165, 1.592, 1.211, 1.064], dtype='f8')\
@@ -288,25 +394,14 @@ class DataRelease(object):
             _covered_brickids = numpy.fromfile(
                 os.path.join(self.cache, 'covered_brickids.i8'), dtype='i8')
         except IOError:
-            
-            _covered_brickids = [ ]
-            for roots, dirnames, filenames in \
-                os.walk(os.path.join(self.root, 'tractor'), followlinks=True):
-                for filename in filenames:
-                    try:
-                        _covered_brickids.append(
-                            myschema.parse_filename(filename, self.brickindex))
-                    except ValueError:
-                        pass 
-            _covered_brickids = numpy.array(_covered_brickids, dtype='i8')
-            _covered_brickids.tofile(os.path.join(self.cache, 'covered_brickids.i8'))
+            _covered_brickids = self.scan_covered_bricks()
             
         # the list of covered bricks must be sorted.
         _covered_brickids.sort()
 
         self._covered_brickids = _covered_brickids
 
-        bricks = [self.brickindex.get_brick(bid) for bid in _covered_brickids]
+        bricks = self.brickindex.get_bricks(_covered_brickids)
 
         self.footprint = Footprint(bricks, self.brickindex) # build the footprint property
 
@@ -316,6 +411,82 @@ class DataRelease(object):
 
         self.schema = myschema
 
+    def scan_covered_bricks(self, nthreads=None):
+        """ Scan the tractor directory for the covered bricks.
+
+            The sub-directories of `tractor/` are scanned in parallel.
+            A manifest of the scan (modification time and bricks
+            of each sub-directory) is stored as covered_bricks.manifest.json
+            in the cache; later scans only rescan sub-directories that
+            are new or have been modified. The result is also written
+            to covered_brickids.i8.
+
+            The modification time of a directory only changes when entries
+            directly inside it are added or removed, which is the case for
+            the tractor/xxx/ layout of the data releases.
+
+            Parameters
+            ----------
+            nthreads : int or None
+                number of threads; None for the number of CPUs.
+
+            Returns
+            -------
+            covered_brickids : array_like
+                sorted internal index of the covered bricks.
+        """
+        myschema = getattr(schema, self.version)
+        tractor = os.path.join(self.root, 'tractor')
+        manifestfile = os.path.join(self.cache, 'covered_bricks.manifest.json')
+        try:
+            with open(manifestfile, 'r') as ff:
+                manifest = json.load(ff)
+        except (IOError, ValueError):
+            manifest = {}
+
+        files, dirs = dirscan.listdir(tractor)
+
+        def scan(subdir):
+            # '.' are the catalogue files directly in tractor/
+            path = os.path.join(tractor, subdir)
+            mtime = os.stat(path).st_mtime
+            entry = manifest.get(subdir)
+            if entry is not None and entry['mtime'] == mtime:
+                return entry
+            if subdir == '.':
+                filenames = files
+            else:
+                filenames = dirscan.walk(path)
+            bricks = myschema.parse_filenames(filenames, self.brickindex)
+            return dict(mtime=mtime, bricks=bricks.tolist())
+
+        subdirs = ['.'] + sorted(dirs)
+        entries = dirscan.threadmap(scan, subdirs, nthreads=nthreads)
+        manifest = dict(zip(subdirs, entries))
+
+        _covered_brickids = numpy.concatenate(
+                [numpy.array(entry['bricks'], dtype='i8') for entry in entries])
+        _covered_brickids = numpy.unique(_covered_brickids)
+
+        try:
+            with open(manifestfile + '.tmp-%d' % os.getpid(), 'w') as ff:
+                json.dump(manifest, ff)
+            os.rename(manifestfile + '.tmp-%d' % os.getpid(), manifestfile)
+            _covered_brickids.tofile(os.path.join(self.cache, 'covered_brickids.i8'))
+        except (IOError, OSError):
+            # the cache directory may be frozen.
+            pass
+        return _covered_brickids
+
+    def refresh_footprint(self, nthreads=None):
+        """ Rescan the tractor directory and update the footprint.
+
+            Only modified sub-directories are rescanned;
+            see :py:meth:`scan_covered_bricks`.
+        """
+        self._covered_brickids = self.scan_covered_bricks(nthreads=nthreads)
+        self.init_from_state()
+
     def create_footprint(self, extent):
         """ Create a footprint based on the extent.
 
@@ -327,6 +498,40 @@ class DataRelease(object):
         bricks = self.brickindex.query_region(extent)
         return Footprint(bricks, self.brickindex)
 
+    def get_healpix_index(self, nside):
+        """ Returns the cross index between HEALPix pixels (nested) and
+            the covered bricks.
+
+            The index is built on the first use and cached as
+            `healpix_bricks_<nside>.npz` next to covered_brickids.i8.
+
+            Parameters
+            ----------
+            nside : int
+                resolution of the HEALPix map.
+
+            Returns
+            -------
+            hpindex : :py:class:`~model.healpixindex.HealpixIndex`
+        """
+        filename = os.path.join(self.cache, 'healpix_bricks_%d.npz' % nside)
+        try:
+            hpindex = HealpixIndex.load(filename)
+            if numpy.array_equal(hpindex.bricks, self._covered_brickids):
+                return hpindex
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+            # missing, or truncated by an interrupted writer; rebuild.
+            pass
+
+        hpindex = HealpixIndex.build(self.brickindex, nside,
+                bricks=self._covered_brickids)
+        try:
+            hpindex.save(filename)
+        except (IOError, OSError):
+            # the cache directory may be frozen.
+            pass
+        return hpindex
+
     def create_catalogue(self, footprint):
         """ Create a catalogue based on the footprint.
 
@@ -344,30 +549,225 @@ class DataRelease(object):
     def init_from_state(self):
         myschema = getattr(schema, self.version)
 
-        bricks = [self.brickindex.get_brick(bid) for bid in self._covered_brickids]
+        bricks = self.brickindex.get_bricks(self._covered_brickids)
         self.footprint = Footprint(bricks, self.brickindex) # build the footprint property
 
+        self.image_cache = ImageCache(self.image_cache_size)
+        self._wcs_tables = {}
+        self._wcs_checked = {}
+        if self.use_pixel_cache:
+            pixelcache = os.path.join(self.cache, 'pixels')
+        else:
+            pixelcache = None
+        pyramid = os.path.join(self.cache, 'pyramid')
+        metastore = os.path.join(self.cache, 'metadata')
+        manifest = os.path.join(self.cache, 'manifest')
+
         self.images = {}
         image_filenames = myschema.format_image_filenames()
         for image in image_filenames:
             if isinstance(image_filenames[image], dict):
                 self.images[image] = {}
                 for band in image_filenames[image]:
-                    self.images[image][band] = imagerepo.ImageRepo(self.root, image_filenames[image][band], image_hdu=myschema.IMAGE_HDU)
+                    self.images[image][band] = imagerepo.ImageRepo(self.root, image_filenames[image][band], image_hdu=myschema.IMAGE_HDU,
+                            cache=self.image_cache, pixelcache=pixelcache, pyramid=pyramid,
+                            name='%s-%s' % (image, band), metastore=metastore,
+                            manifest=manifest)
             else:
-                self.images[image] = imagerepo.ImageRepo(self.root, image_filenames[image], image_hdu=myschema.IMAGE_HDU)
+                self.images[image] = imagerepo.ImageRepo(self.root, image_filenames[image], image_hdu=myschema.IMAGE_HDU,
+                        cache=self.image_cache, pixelcache=pixelcache, pyramid=pyramid,
+                        name=image, metastore=metastore, manifest=manifest)
 
     def __getstate__(self):
         d = self.__dict__.copy()
         del d['footprint']
         del d['images']
+        del d['image_cache']
+        del d['_wcs_tables']
+        del d['_wcs_checked']
         return d
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self.init_from_state()
  
-    def readout(self, coord, repo, default=numpy.nan, ignore_missing=False):
+    def build_file_manifest(self, workers=None):
+        """ Scan the coadd directory and build the manifests of the image
+            files of all image repositories, for the bricks in the footprint.
+
+            With the manifests, the filenames are resolved and missing
+            images are detected without touching the file system.
+            The manifests are stored in `cache/manifest`, and shall be
+            rebuilt if files are added to the data release.
+
+            Only the sub-directories that hold image files of the
+            footprint are listed.
+
+            Parameters
+            ----------
+            workers : int or None
+                number of threads to scan the sub-directories with;
+                None for the number of CPUs.
+
+            Returns
+            -------
+            nfiles : int
+                number of image files of the footprint that are found.
+        """
+        repos = []
+        for image in self.images:
+            if isinstance(self.images[image], dict):
+                repos.extend(self.images[image].values())
+            else:
+                repos.append(self.images[image])
+
+        # the names of the image files of the footprint, grouped by
+        # sub-directories; only these directories are listed.
+        scanned = os.path.join('coadd', '')
+        expected = {}
+        for repo in repos:
+            for brick in self.footprint.bricks:
+                fn = os.path.relpath(repo._format_filename(brick), self.root)
+                if not fn.startswith(scanned):
+                    continue
+                subdir, name = os.path.split(fn)
+                names = expected.setdefault(subdir, set())
+                names.add(name)
+                names.add(name + '.gz')
+
+        def scan(subdir):
+            try:
+                files, dirs = dirscan.listdir(os.path.join(self.root, subdir))
+            except OSError:
+                # no images of these bricks.
+                return []
+            names = expected[subdir]
+            return [os.path.join(subdir, f) for f in files if f in names]
+
+        found = set()
+        for files in dirscan.threadmap(scan, sorted(expected), nthreads=workers):
+            found.update(files)
+
+        for repo in repos:
+            repo.build_manifest(self.footprint.bricks, found, 'coadd')
+        return len(found)
+
+    def get_wcs_table(self, repo):
+        """ Returns the WCS table of an image repository, or None if
+            it has not been built with :py:meth:`build_wcs_table`.
+
+            The table is stored in `cache/wcs`. A table built for other
+            bricks than those of the footprint (e.g. before
+            :py:meth:`refresh_footprint`) is out of date and not used.
+        """
+        if repo.name is None:
+            return None
+        if repo.name not in self._wcs_tables:
+            try:
+                table = numpy.load(os.path.join(self.cache, 'wcs', repo.name + '.npy'))
+            except (IOError, OSError, ValueError):
+                table = None
+            if table is not None:
+                if table.dtype != imagerepo.WCS_TABLE_DTYPE \
+                or not numpy.array_equal(table['BRICK'], self.footprint.bricks.index):
+                    warnings.warn("The WCS table of %s is out of date; rebuild it with build_wcs_table." % repo.name)
+                    table = None
+            self._wcs_tables[repo.name] = table
+            if table is not None:
+                self._wcs_checked[repo.name] = numpy.zeros(len(table), dtype='?')
+        return self._wcs_tables[repo.name]
+
+    def _check_wcs_table(self, repo, table, rows):
+        """ Invalidate the rows of the WCS table whose image file has
+            changed since the table was built. Each row is checked once.
+        """
+        checked = self._wcs_checked[repo.name]
+        for row in rows[~checked[rows]]:
+            if table['VALID'][row]:
+                brick = self.brickindex.get_brick(table['BRICK'][row])
+                try:
+                    mtime = os.stat(repo.get_filename(brick)).st_mtime
+                except OSError:
+                    mtime = None
+                if mtime != table['MTIME'][row]:
+                    # fall back to reading the header.
+                    table['VALID'][row] = False
+            checked[row] = True
+
+    def build_wcs_table(self, repo, workers=None):
+        """ Build the WCS table of an image repository for the bricks
+            in the footprint, and store it in the cache.
+
+            With the table, :py:meth:`readout` projects the points to pixels
+            of all bricks in one call, without reading the headers.
+            See :py:meth:`~model.imagerepo.ImageRepo.wcs_table`.
+
+            Parameters
+            ----------
+            repo : ImageRepo
+                the image repository, e.g. self.images['depth']['r']
+            workers : int or None
+                number of threads to read the headers with;
+                None for the number of CPUs.
+
+            Returns
+            -------
+            table : array_like
+                the WCS table, sorted by the internal index of bricks.
+        """
+        table = repo.wcs_table(self.footprint.bricks, workers=workers)
+
+        filename = os.path.join(self.cache, 'wcs', repo.name + '.npy')
+        try:
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:
+                # already exists
+                pass
+            with open(filename + '.tmp-%d' % os.getpid(), 'wb') as ff:
+                numpy.save(ff, table)
+            os.rename(filename + '.tmp-%d' % os.getpid(), filename)
+        except (IOError, OSError):
+            # the cache directory may be frozen.
+            pass
+
+        self._wcs_tables[repo.name] = table
+        self._wcs_checked[repo.name] = numpy.ones(len(table), dtype='?')
+        return table
+
+    def _project(self, view, bid, repo):
+        """ Project points at view=(RA, DEC) to pixels of bricks bid,
+            with the WCS table of repo.
+
+            Returns
+            -------
+            xy, shape : the pixel coordinates and the (ny, nx) image shape
+            of each point; None if the table has not been built.
+            Points of bricks not in the table, or whose image changed
+            after the table was built, have NaN xy; they are projected
+            with the headers.
+        """
+        table = self.get_wcs_table(repo)
+        if table is None or len(table) == 0:
+            return None, None
+        row = table['BRICK'].searchsorted(bid).clip(0, len(table) - 1)
+        self._check_wcs_table(repo, table, numpy.unique(row))
+        good = (table['BRICK'][row] == bid) & table['VALID'][row]
+
+        xy = numpy.empty((2, len(bid)))
+        xy[...] = numpy.nan
+        shape = numpy.zeros((2, len(bid)), dtype='i8')
+
+        # only the rows of the table that are used
+        urow, index = numpy.unique(row[good], return_inverse=True)
+        table = table[urow]
+        xy[:, good] = wcs_tangent.ang2pix_indexed(view[:, good], index,
+                table['CD'].T, table['CRPIX'].T, table['CRVAL'].T)
+        shape[:, good] = table['SHAPE'][index].T
+        return xy, shape
+
+    def readout(self, coord, repo, default=numpy.nan, ignore_missing=False,
+            neighbours=False, workers=1, resolution=1, statistic='median'):
         """ Readout pixels from an image.
             
             Parameters
@@ -381,6 +781,22 @@ class DataRelease(object):
             image_missing : boolean
                 When ignore_missing is True, missing brick files are treated
                 as not in the footprint.
+            neighbours : boolean
+                When neighbours is True, pixels that fall outside of the image
+                of their brick are read from the images of the neighbouring
+                bricks in the footprint.
+            workers : int or None
+                number of threads to read the bricks with; None for
+                the number of CPUs. Reading and decompressing the images
+                releases the GIL.
+            resolution : int
+                1 to read the images exactly. If larger, read from images
+                block downsampled by this factor, which are built on the
+                first use and stored in `cache/pyramid`, e.g. 8 or 32;
+                see imglss-mpi-build-pixel-cache.py.
+            statistic : string
+                statistic of the blocks of the downsampled images,
+                'min' or 'median'.
 
             Notes
             -----
@@ -391,7 +807,52 @@ class DataRelease(object):
 
             Otherwise it makes more sense to
             have readout in ImageRepo.
+
+            See :py:meth:`readout_many` for reading several images
+            at the same pixels.
+        """
+        return self.readout_many(coord, {'image' : repo}, default=default,
+                ignore_missing=ignore_missing, neighbours=neighbours,
+                workers=workers, resolution=resolution,
+                statistic=statistic)['image']
+
+    def readout_many(self, coord, repos, default=numpy.nan, ignore_missing=False,
+            neighbours=False, workers=1, resolution=1, statistic='median'):
+        """ Readout pixels from several images of the same bricks.
+
+            The bricks of the pixels and the pixel coordinates are computed
+            only once for all images, since all images of a brick share the
+            same WCS.
+
+            Parameters
+            ----------
+            coord  : array_like
+                coordinates of the pixels, (RA, DEC)
+            repos  : dict
+                the images to read from, keyed by the name of the column
+                in the output.
+            default : scalar
+                value to return if the pixel is not in the footprint.
+            ignore_missing : boolean
+                When ignore_missing is True, missing brick files are treated
+                as not in the footprint.
+            neighbours : boolean
+                see :py:meth:`readout`.
+            workers : int or None
+                see :py:meth:`readout`.
+            resolution : int
+                see :py:meth:`readout`.
+            statistic : string
+                see :py:meth:`readout`.
+
+            Returns
+            -------
+            images : array_like
+                a structured array with a 'f4' column per item of repos.
         """
+        names = list(repos.keys())
+        repos = [repos[name] for name in names]
+
         coord = numpy.array(coord)
         if coord.ndim == 1:
             view = coord.reshape(2, 1)
@@ -399,57 +860,108 @@ class DataRelease(object):
             view = coord
 
         RA, DEC = view
-        images = numpy.empty(RA.shape, dtype='f4')
-        images[...] = default
+        images = numpy.empty(RA.shape, dtype=[(name, 'f4') for name in names])
+        for name in names:
+            images[name] = default
 
         bid = self.brickindex.query_internal(view)
 
-        mask = contains(self._covered_brickids, bid)
+        mask = self.footprint.covers(bid)
 
-        ra = RA[mask]
-        dec = DEC[mask]
-        if len(ra) == 0:
+        if not mask.any():
             # do not try to work if no point is within the
             # survey 
-            return images
+            return images.reshape(coord[0].shape)
+
+        view = view[:, mask]
+        bid = bid[mask]
+
+        options = dict(resolution=resolution, statistic=statistic)
+        pixels, inside, missing = self._readout_bricks(view, bid, repos,
+                default, ignore_missing, workers, options)
+
+        if neighbours:
+            # retry points that are outside of the image of their brick.
+            todo = ~inside & ~missing
+            retry = todo.any(axis=0).nonzero()[0]
+            candidates = self.brickindex.query_neighbours(bid[retry])
+            for k in range(candidates.shape[1]):
+                nbid = candidates[:, k]
+                ok = self.footprint.covers(nbid)
+                if not ok.any(): continue
+                sel = retry[ok]
+                pixels1, inside1, missing1 = self._readout_bricks(
+                        view[:, sel], nbid[ok], repos,
+                        default, ignore_missing, workers, options)
+                found = todo[:, sel] & inside1
+                pixels[:, sel] = numpy.where(found, pixels1, pixels[:, sel])
+                todo[:, sel] &= ~found
+                keep = todo[:, retry].any(axis=0)
+                retry = retry[keep]
+                candidates = candidates[keep]
+        #
+        for name, p in zip(names, pixels):
+            images[name][mask] = p
+            
+        return images.reshape(coord[0].shape)
 
-        view, invarg = self.brickindex.optimize((ra, dec), return_inverse=True)
-        bid = self.brickindex.query_internal(view)
+    def _readout_bricks(self, view, bid, repos, default, ignore_missing, workers=1,
+            options={}):
+        """ Readout pixels at view=(RA, DEC) from the images of bricks bid.
+            options are passed to :py:meth:`~model.brick.Brick.readout_many`.
 
-        pixels = numpy.empty(len(bid), 'f8')
-        pixels[:] = default
+            Returns
+            -------
+            pixels, inside, missing : (len(repos), N) arrays of
+            the pixel values, whether the pixel is inside the image,
+            and whether the image file is missing.
+        """
+        # group the points by bricks
+        arg, invarg, offsets = self.brickindex.bucket(bid)
+        view = view[:, arg]
 
-        
-        ubid = numpy.unique(bid)
+        pixels = numpy.empty((len(repos), len(arg)), 'f8')
+        pixels[...] = default
+        inside = numpy.zeros((len(repos), len(arg)), '?')
+        missing = numpy.zeros((len(repos), len(arg)), '?')
+
+        ubid = (offsets[1:] != offsets[:-1]).nonzero()[0]
 
-        for b in ubid:
-            if b not in self._covered_brickids:
-                continue
+        # project all points before reading any image;
+        # all images of a brick share the same WCS.
+        xy, shape = None, None
+        if len(repos) > 0:
+            xy, shape = self._project(view, bid[arg], repos[0])
+
+        def work(b):
+            # bricks own disjoint slices of the output.
             brick = self.brickindex.get_brick(b)
-            first = bid.searchsorted(b, side='left')
-            last = bid.searchsorted(b, side='right')
-            sl = slice(first, last)
+            sl = slice(offsets[b], offsets[b + 1])
 
-            try:
-                img = brick.readout(view[:, sl], repo, default=default)
-                #print( 'readout', b, img)
-                pixels[sl] = img
-            except IOError as e:
-                #print( 'readout', b, self.brickindex.get_brick(b), 'error', e, view)
-                if not ignore_missing:
-                    raise
-                else:
-                    #warnings.warn(str(e), stacklevel=2)
-                    pass
-        #
-        images[mask] = pixels[invarg]
-            
-        return images.reshape(coord[0].shape)
+            kwargs = dict(options)
+            if xy is not None and not numpy.isnan(xy[0, sl.start]):
+                kwargs['xy'] = xy[:, sl]
+                kwargs['shape'] = tuple(shape[:, sl.start])
+
+            pixels[:, sl], inside[:, sl], missing1 = brick.readout_many(
+                    view[:, sl], repos, default=default,
+                    ignore_missing=ignore_missing, **kwargs)
+            missing[missing1, sl] = True
+
+        dirscan.threadmap(work, ubid, nthreads=workers)
+
+        return pixels[:, invarg], inside[:, invarg], missing[:, invarg]
 
-    def read_depths(self, coord, bands=[]):
+    def read_depths(self, coord, bands=[], workers=1):
         """ Read the depth of given bands, 
             return as an array
 
+            Parameters
+            ----------
+            workers : int or None
+                number of threads to read the bricks with;
+                see :py:meth:`readout`.
+
             Returns
             -------
             array of dtype DECAM_DEPTH and DECAM_MW_TRANSMISSION.
@@ -467,13 +979,15 @@ class DataRelease(object):
         coord = numpy.array(coord)
         output = numpy.zeros(coord[0].shape, dtype)
 
+        depths = self.readout_many(coord,
+                dict([(band, self.images['depth'][band]) for band in bands]),
+                default=+0.0, ignore_missing=True, workers=workers)
+
         ebv = self.sfdmap.ebv(coord[0], coord[1])
         for band in bands:
             ind = self.bands[band]
 
-            output['DECAM_DEPTH'][..., ind] = \
-                    self.readout(coord, self.images['depth'][band], 
-                    default=+0.0, ignore_missing=True)
+            output['DECAM_DEPTH'][..., ind] = depths[band]
             output['DECAM_MW_TRANSMISSION'][..., ind] =  \
                     10 ** (- ebv * self.extinction[band] / 2.5)
 
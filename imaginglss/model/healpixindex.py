@@ -0,0 +1,180 @@
+"""
+Python code to cross index HEALPix pixels and bricks, such that
+HEALPix maps can be made from bricks with array lookups.
+
+"""
+import os
+import numpy
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+
+class HealpixIndex(object):
+    """
+    A cross index between HEALPix pixels and bricks.
+
+    The pixels are in the nested ordering. Each overlapping pair of a
+    pixel and a brick is stored, with the fraction of the area of
+    the pixel that is in the brick. The fraction is estimated by
+    assigning the child pixels at a higher resolution to bricks.
+
+    Usually the index is built and cached by
+    :py:meth:`~model.datarelease.DataRelease.get_healpix_index`.
+
+    Attributes
+    ----------
+    nside : int
+        resolution of the HEALPix map.
+    bricks : array_like
+        sorted internal index of the bricks that are indexed.
+    pixel : array_like
+        pixel of each pair, sorted.
+    brick : array_like
+        internal index of the brick of each pair.
+    weight : array_like
+        fraction of the area of the pixel that is in the brick.
+
+    """
+    def __init__(self, nside, bricks, pixel, brick, weight):
+        self.nside = nside
+        self.npix = 12 * nside ** 2
+        self.bricks = bricks
+        self.pixel = pixel
+        self.brick = brick
+        self.weight = weight
+        self.brick_sortarg = brick.argsort(kind='mergesort')
+        self.brick_sorted = brick[self.brick_sortarg]
+
+    @classmethod
+    def build(kls, brickindex, nside, bricks=None, nsub=None, chunksize=1024 * 1024):
+        """
+        Build the index. Requires healpy.
+
+        Parameters
+        ----------
+        brickindex : :py:class:`~model.brickindex.BrickIndex`
+            the brick index.
+        nside : int
+            resolution of the HEALPix map.
+        bricks : array_like or None
+            internal index of bricks to index. None for all bricks.
+        nsub : int or None
+            number of child pixels per side of a pixel to estimate the
+            overlapping area. Must be a power of 2. Default is such that
+            the child pixels are no larger than 1/4 of a brick.
+        chunksize : int
+            number of child pixels to process at once.
+
+        """
+        import healpy
+
+        if nsub is None:
+            nsub = 1
+            while nside * nsub < 1024:
+                nsub *= 2
+
+        mask = numpy.zeros(len(brickindex), dtype='?')
+        if bricks is None:
+            mask[...] = True
+        else:
+            mask[bricks] = True
+
+        npix = 12 * nside ** 2
+        nchild = nsub ** 2
+        nbricks = len(brickindex)
+
+        pixel = []
+        brick = []
+        weight = []
+        step = max(chunksize // nchild, 1)
+        for start in range(0, npix, step):
+            pix = numpy.arange(start, min(start + step, npix), dtype='i8')
+            child = (pix[:, None] * nchild + numpy.arange(nchild)[None, :]).ravel()
+            ra, dec = healpy.pix2ang(nside * nsub, child, nest=True, lonlat=True)
+            bid = brickindex.query_internal((ra, dec))
+            sel = mask[bid]
+            key = (child[sel] // nchild) * nbricks + bid[sel]
+            key, count = numpy.unique(key, return_counts=True)
+            pixel.append(key // nbricks)
+            brick.append(key % nbricks)
+            weight.append(count * (1.0 / nchild))
+
+        return kls(nside, mask.nonzero()[0],
+                numpy.concatenate(pixel),
+                numpy.concatenate(brick),
+                numpy.concatenate(weight))
+
+    def save(self, filename):
+        """ Save the index to a .npz file. """
+        tmp = filename + '.tmp-%d' % os.getpid()
+        with open(tmp, 'wb') as ff:
+            numpy.savez(ff, nside=self.nside, bricks=self.bricks,
+                pixel=self.pixel, brick=self.brick, weight=self.weight)
+        os.rename(tmp, filename)
+
+    @classmethod
+    def load(kls, filename):
+        """ Load the index from a .npz file. """
+        with numpy.load(filename) as ff:
+            return kls(int(ff['nside']), ff['bricks'], ff['pixel'], ff['brick'], ff['weight'])
+
+    @staticmethod
+    def _select(haystack, keys):
+        """ positions of items in the sorted haystack that match any of keys. """
+        keys = numpy.unique(keys)
+        start = haystack.searchsorted(keys, side='left')
+        end = haystack.searchsorted(keys, side='right')
+        length = end - start
+        offset = numpy.repeat(start - (length.cumsum() - length), length)
+        return numpy.arange(length.sum()) + offset
+
+    def query_bricks(self, pixels):
+        """ Returns the sorted internal index of bricks overlapping with pixels. """
+        ind = self._select(self.pixel, pixels)
+        return numpy.unique(self.brick[ind])
+
+    def query_pixels(self, bricks):
+        """ Returns the sorted pixels overlapping with bricks. """
+        ind = self._select(self.brick_sorted, bricks)
+        return numpy.unique(self.pixel[self.brick_sortarg[ind]])
+
+    def coverage(self, bricks):
+        """
+        Returns a HEALPix map of the fraction of the area of each pixel
+        that is covered by bricks.
+
+        Parameters
+        ----------
+        bricks : array_like
+            internal index of the bricks, e.g. the bricks of a footprint.
+
+        """
+        ind = self._select(self.brick_sorted, bricks)
+        ind = self.brick_sortarg[ind]
+        return numpy.bincount(self.pixel[ind], weights=self.weight[ind],
+                minlength=self.npix)
+
+    def aggregate(self, values, default=numpy.nan):
+        """
+        Returns a HEALPix map of the area weighted mean of values
+        of the bricks overlapping each pixel.
+
+        Parameters
+        ----------
+        values : array_like
+            a value per brick, indexed by the internal index of bricks.
+        default : float
+            value of pixels that overlap with no bricks.
+
+        """
+        values = numpy.asarray(values)[self.brick]
+        total = numpy.bincount(self.pixel, weights=self.weight * values,
+                minlength=self.npix)
+        norm = numpy.bincount(self.pixel, weights=self.weight,
+                minlength=self.npix)
+        result = numpy.empty(self.npix)
+        result[...] = default
+        nonzero = norm > 0
+        result[nonzero] = total[nonzero] / norm[nonzero]
+        return result
@@ -0,0 +1,95 @@
+"""
+A memory budgeted cache of images, shared by the image repositories
+of a data release.
+
+"""
+import threading
+from collections import OrderedDict
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+
+class ImageCache(object):
+    """
+    A least recently used cache of images, limited by the total
+    number of bytes of the images.
+
+    The cache is thread-safe. Images are stored read-only, because
+    they are shared by all users of the cache; :py:meth:`put` marks
+    the array it is given read-only, unless the array is larger than
+    the budget and not cached.
+
+    Attributes
+    ----------
+    maxbytes : int
+        budget of the cache in bytes. Images larger than the budget
+        are never cached; the default 0 disables the cache.
+    nbytes : int
+        number of bytes currently used by the cached images.
+    hits : int
+        number of lookups that found the image.
+    misses : int
+        number of lookups that did not find the image. Lookups
+        are not counted while the cache is disabled.
+    evictions : int
+        number of images evicted to stay in the budget.
+
+    """
+    def __init__(self, maxbytes=0):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return ("ImageCache(images=%d, nbytes=%d, maxbytes=%d, hits=%d, misses=%d, evictions=%d)"
+            % (len(self), self.nbytes, self.maxbytes, self.hits, self.misses, self.evictions))
+
+    def get(self, key):
+        """ Returns the image of key, or None if it is not cached. """
+        if self.maxbytes <= 0:
+            # disabled; nothing is ever cached.
+            return None
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # move to the most recently used end.
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Add the image of key to the cache, evicting the least recently used images. """
+        size = value.nbytes
+        if size > self.maxbytes:
+            return
+        value.flags.writeable = False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            while self._data and self.nbytes + size > self.maxbytes:
+                _, evicted = self._data.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+            self._data[key] = value
+            self.nbytes += size
+
+    def clear(self):
+        """ Remove all images from the cache; the counters are kept. """
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
@@ -1,5 +1,77 @@
 from ..utils import fits
+from ..utils import wcs_tangent
+from ..utils import dirscan
+from .imagecache import ImageCache
 import os.path
+import threading
+import numpy
+
+WCS_TABLE_DTYPE = numpy.dtype([
+    ('BRICK', 'i8'),
+    ('VALID', '?'),
+    ('CD', ('f8', 4)),
+    ('CRPIX', ('f8', 2)),
+    ('CRVAL', ('f8', 2)),
+    ('SHAPE', ('i8', 2)),
+    ('MTIME', 'f8'),
+])
+
+METADATA_DTYPE = numpy.dtype([
+    ('BRICK', 'i8'),
+    ('MTIME', 'f8'),
+    ('CTYPE1', 'S8'),
+    ('CTYPE2', 'S8'),
+    ('CRVAL1', 'f8'),
+    ('CRVAL2', 'f8'),
+    ('CRPIX1', 'f8'),
+    ('CRPIX2', 'f8'),
+    ('CD1_1', 'f8'),
+    ('CD1_2', 'f8'),
+    ('CD2_1', 'f8'),
+    ('CD2_2', 'f8'),
+    ('NAXIS1', 'i8'),
+    ('NAXIS2', 'i8'),
+])
+
+MANIFEST_DTYPE = numpy.dtype([
+    ('BRICK', 'i8'),
+    ('VARIANT', 'i1'),
+])
+
+# variants of the image file of a brick in the manifest
+FILE_MISSING = 0
+FILE_PLAIN = 1
+FILE_GZ = 2
+
+def _image_shape(meta):
+    """ (ny, nx) of an image from its header. """
+    # the header of a tile compressed image may be that of the table.
+    return (meta.get('ZNAXIS2', meta['NAXIS2']),
+            meta.get('ZNAXIS1', meta['NAXIS1']))
+
+def _isfresh(cachename, fname):
+    """ True if the cache file exists and is not older than fname. """
+    try:
+        return os.stat(cachename).st_mtime >= os.stat(fname).st_mtime
+    except OSError:
+        return False
+
+def _savenpy(cachename, array):
+    """ Atomically save array to cachename; False if the cache is not writable. """
+    try:
+        try:
+            os.makedirs(os.path.dirname(cachename))
+        except OSError:
+            # already exists
+            pass
+        tmp = cachename + '.tmp-%d-%d' % (os.getpid(), threading.current_thread().ident)
+        # numpy.save adds .npy to the name
+        numpy.save(tmp, array)
+        os.rename(tmp + '.npy', cachename)
+    except (IOError, OSError):
+        # the cache directory may be frozen.
+        return False
+    return True
 
 class ImageRepo(object):
     """
@@ -10,9 +82,55 @@ class ImageRepo(object):
     Given a Brick object, ImageRepo can return the image data
     or meta data of the image.
     Standard users should not need to modify this class.
+
+    Attributes
+    ----------
+    cache : :py:class:`~model.imagecache.ImageCache`
+        cache of the images, keyed by (repo, brick index). The cache
+        can be shared by several repositories.
+    window_gap : int
+        rows between points larger than this start a new window
+        in :py:meth:`read_pixels`.
+    window_maxfraction : float
+        :py:meth:`read_pixels` reads the full image if the windows
+        cover more than this fraction of the image.
+    window_maxcount : int
+        :py:meth:`read_pixels` reads the full image if there are
+        more windows than this.
+    pixelcache : string or None
+        directory of the pixel cache, where decompressed images are
+        stored as little endian .npy files, by the filename relative
+        to root. The files are memory mapped, such that
+        reading from them involves no decompression and the pages
+        are shared by all processes on a node.
+    pyramid : string or None
+        directory of the block downsampled images, stored as .npy
+        files by the filename relative to root;
+        see :py:meth:`build_pyramid`.
+    pyramid_factors : list
+        default downsampling factors of :py:meth:`build_pyramid`.
+    pyramid_statistics : list
+        default statistics of :py:meth:`build_pyramid`.
+    metastore : string or None
+        directory of the metadata store, where the WCS and the shape
+        of the images are stored in a file per repository,
+        `<name>.npy`; see :py:meth:`build_metastore`.
+    manifest : string or None
+        directory of the file manifests, where the variant of the
+        image file of each brick (missing, plain or gzipped) is stored
+        in a file per repository, `<name>.npy`;
+        see :py:meth:`build_manifest`. Bricks in the manifest
+        are resolved without touching the file system.
     
     """
-    def __init__(self, root, pattern, image_hdu):
+    window_gap = 32
+    window_maxfraction = 0.25
+    window_maxcount = 64
+    pyramid_factors = [8, 32]
+    pyramid_statistics = ['min', 'median']
+
+    def __init__(self, root, pattern, image_hdu, cache=None, pixelcache=None, pyramid=None,
+            name=None, metastore=None, manifest=None):
         """
         Initizlize a ImageRepo.
 
@@ -25,20 +143,45 @@ class ImageRepo(object):
             root path that is concatenated to the pattern.
         image_hdu : int
             HDU for the image.
+        cache : :py:class:`~model.imagecache.ImageCache` or None
+            the image cache; None to create a private cache with
+            the default budget.
+        pixelcache : string or None
+            directory of the pixel cache; None to disable the pixel cache.
+        pyramid : string or None
+            directory of the downsampled images; None to not store them.
+        name : string or None
+            name of the repository, e.g. 'depth-r'.
+        metastore : string or None
+            directory of the metadata store; None to disable the store.
+            Requires name.
+        manifest : string or None
+            directory of the file manifests; None to disable the manifest.
+            Requires name.
         """
+        if cache is None:
+            cache = ImageCache()
         self.root = root
         self.pattern = pattern
-        self.cache = {}
+        self.cache = cache
         self.meta_cache = {}
         self.image_hdu = image_hdu
+        self.pixelcache = pixelcache
+        self.pyramid = pyramid
+        self.name = name
+        self.metastore = metastore
+        self._metastore = None
+        self.manifest = manifest
+        self._manifest = None
 
     def preload(self, bricks, **kwargs):
         """ 
         Preload images into the cache
     
         This function loads images for given bricks into the cache.
-        In generate the function is not useful, and we shall
-        try to remove it soon.
+        In generate the function is not useful, since :py:meth:`open`
+        always uses the cache, and we shall try to remove it soon.
+        Images beyond the budget of the cache are evicted.
 
         Parameters
         ----------
@@ -47,16 +190,23 @@ class ImageRepo(object):
 
         """
         for b in bricks:
-            self.cache[b] = self.open(b, **kwargs) 
+            self.open(b, **kwargs)
             
     def open(self, brick, **kwargs):
         """ 
         Open and read an image.
 
         The image for Brick object brick is read into memory and returned.
-        If the image is already in cache, return the cache.
-        
-        This function does not add the image to cache.
+        If the image is already in cache, return the cache;
+        otherwise the image is added to the cache.
+
+        If the pixel cache is enabled, a memory map of the pixel
+        cache file is returned instead, and the file is created
+        if it is missing or older than the image.
+
+        If the image cache is enabled (a positive budget) or the pixel
+        cache is used, the returned image is shared and read-only; copy
+        it before modifying it. Otherwise it is a private array.
 
         Parameters
         ----------
@@ -69,13 +219,231 @@ class ImageRepo(object):
             the image as an ndarray, as the ordering in FITS files.
             (index with (y, x))
         """
-        if brick in self.cache:
-            return self.cache[brick]
+        # kwargs are used in the filename
+        key = (self, brick.index) + tuple(sorted(kwargs.items()))
+        img = None
+        if self.pixelcache is None:
+            img = self.cache.get(key)
+        if img is not None:
+            return img
         fname = self.get_filename(brick, **kwargs)
-        if not os.path.exists(fname):
+        if not self.exists(brick, **kwargs):
             raise IOError('%s does not exist' % fname)
         _ = self.metadata(brick, **kwargs)
-        return fits.read_image(fname, hdu=self.image_hdu)
+        if self.pixelcache is not None:
+            return self._open_pixelcache(fname)
+        img = fits.read_image(fname, hdu=self.image_hdu)
+        self.cache.put(key, img)
+        return img
+
+    def _open_pixelcache(self, fname):
+        """ Memory map the pixel cache of an image file, filling it if needed. """
+        cachename = self._cachefile(self.pixelcache, fname, '.npy')
+        if _isfresh(cachename, fname):
+            return numpy.load(cachename, mmap_mode='r')
+
+        img = fits.read_image(fname, hdu=self.image_hdu)
+        img = img.astype(img.dtype.newbyteorder('<'), copy=False)
+        if not _savenpy(cachename, img):
+            return img
+        return numpy.load(cachename, mmap_mode='r')
+
+    def _cachefile(self, cachedir, fname, suffix):
+        """ Filename of a cache file of an image file. """
+        return os.path.join(cachedir, os.path.relpath(fname, self.root) + suffix)
+
+    def build_pyramid(self, brick, factors=None, statistics=None, **kwargs):
+        """
+        Build block downsampled images of a brick.
+
+        Blocks of factor x factor pixels are reduced with each of
+        statistics, ignoring NaN. The image is padded with NaN to
+        a multiple of factor. The downsampled images are stored as
+        float32 .npy files in the pyramid directory, if it is set.
+
+        Parameters
+        ----------
+        brick : :py:class:`~model.brick.Brick`
+            the brick whose image will be downsampled
+        factors : list or None
+            downsampling factors; None for pyramid_factors.
+        statistics : list or None
+            'min', 'max', 'mean' or 'median'; None for pyramid_statistics.
+
+        Returns
+        -------
+        pyramid : dict
+            the downsampled images, keyed by (factor, statistic).
+        """
+        if factors is None:
+            factors = self.pyramid_factors
+        if statistics is None:
+            statistics = self.pyramid_statistics
+
+        fname = self.get_filename(brick, **kwargs)
+        img = self.open(brick, **kwargs)
+
+        pyramid = {}
+        for factor in factors:
+            ny = -(-img.shape[0] // factor)
+            nx = -(-img.shape[1] // factor)
+            padded = numpy.empty((ny * factor, nx * factor), dtype='f4')
+            padded[...] = numpy.nan
+            padded[:img.shape[0], :img.shape[1]] = img
+            blocks = padded.reshape(ny, factor, nx, factor) \
+                .transpose(0, 2, 1, 3).reshape(ny, nx, factor * factor)
+            for statistic in statistics:
+                reduce = getattr(numpy, 'nan' + statistic)
+                down = reduce(blocks, axis=-1).astype('<f4')
+                pyramid[factor, statistic] = down
+                if self.pyramid is not None:
+                    _savenpy(self._cachefile(self.pyramid, fname,
+                        '.%s%d.npy' % (statistic, factor)), down)
+        return pyramid
+
+    def open_downsampled(self, brick, factor, statistic='median', **kwargs):
+        """
+        Open a block downsampled image of a brick.
+
+        The image is read from the pyramid directory, and built
+        with :py:meth:`build_pyramid` if it is missing or older than
+        the image.
+
+        Returns
+        -------
+        image : array_like
+            the downsampled image; pixel (y, x) of the image is in
+            pixel (y // factor, x // factor).
+        """
+        fname = self.get_filename(brick, **kwargs)
+        if not self.exists(brick, **kwargs):
+            raise IOError('%s does not exist' % fname)
+        if self.pyramid is not None:
+            cachename = self._cachefile(self.pyramid, fname,
+                        '.%s%d.npy' % (statistic, factor))
+            if _isfresh(cachename, fname):
+                return numpy.load(cachename, mmap_mode='r')
+        pyramid = self.build_pyramid(brick, factors=[factor],
+                        statistics=[statistic], **kwargs)
+        return pyramid[factor, statistic]
+
+    def read_pixels(self, brick, xy, resolution=1, statistic='median', shape=None, **kwargs):
+        """
+        Read pixels of an image.
+
+        With the pixel cache, the pixels are read from the
+        pixel cache, which is filled on the first use.
+
+        If the image is not in the cache and the points are sparse,
+        only windows of rows around the points are read; the tiles
+        of a tile compressed image (.fits.fz) outside of the windows
+        are not decompressed. Otherwise the full image is read
+        with :py:meth:`open`. Gzipped images are always read in full.
+
+        Parameters
+        ----------
+        brick : :py:class:`~model.brick.Brick`
+            the brick whose image will be read
+        xy : array_like
+            (2, N) integer pixel coordinates, xy=(x, y).
+        resolution : int
+            if larger than 1, read from the image block downsampled by
+            this factor; see :py:meth:`open_downsampled`.
+        statistic : string
+            statistic of the downsampled image.
+        shape : tuple or None
+            (ny, nx) of the image, if known, e.g. from :py:meth:`wcs_table`;
+            None to read it from the metadata.
+
+        Returns
+        -------
+        values : array_like
+            the pixel values of points that are inside the image.
+        mask : array_like
+            True for points that are inside the image.
+        """
+        x, y = xy
+
+        if resolution != 1:
+            if shape is None:
+                shape = _image_shape(self.metadata(brick, **kwargs))
+            mask = (x >= 0) & (x < shape[1]) & (y >= 0) & (y < shape[0])
+            img = self.open_downsampled(brick, resolution, statistic, **kwargs)
+            return img[y[mask] // resolution, x[mask] // resolution], mask
+
+        key = (self, brick.index) + tuple(sorted(kwargs.items()))
+        if self.pixelcache is not None:
+            img = self.open(brick, **kwargs)
+        else:
+            img = self.cache.get(key)
+        if img is not None:
+            mask = (x >= 0) & (x < img.shape[1]) & (y >= 0) & (y < img.shape[0])
+            return img[y[mask], x[mask]], mask
+
+        fname = self.get_filename(brick, **kwargs)
+        if not self.exists(brick, **kwargs):
+            raise IOError('%s does not exist' % fname)
+
+        if shape is None:
+            shape = _image_shape(self.metadata(brick, **kwargs))
+
+        # shape is (ny, nx); x indexes the columns.
+        mask = (x >= 0) & (x < shape[1]) & (y >= 0) & (y < shape[0])
+        x = x[mask]
+        y = y[mask]
+
+        windows = None
+        if not fname.endswith('.gz'):
+            windows = self._windows(x, y, shape)
+
+        if windows is None:
+            img = fits.read_image(fname, hdu=self.image_hdu)
+            self.cache.put(key, img)
+            return img[y, x], mask
+
+        values = None
+        for sel, (y0, y1), (x0, x1) in windows:
+            window = fits.read_image(fname, hdu=self.image_hdu,
+                    subset=((y0, y1), (x0, x1)))
+            if values is None:
+                values = numpy.empty(len(x), dtype=window.dtype)
+            values[sel] = window[y[sel] - y0, x[sel] - x0]
+        if values is None:
+            values = numpy.empty(0)
+        return values, mask
+
+    def _windows(self, x, y, shape):
+        """ Group points into windows of rows; None if a full read is cheaper.
+
+            Returns
+            -------
+            a list of (sel, (ystart, yend), (xstart, xend)) where sel
+            are the points in the window.
+        """
+        if len(y) == 0:
+            return []
+
+        arg = y.argsort()
+        ys = y[arg]
+        start = numpy.concatenate([[0],
+                (numpy.diff(ys) > self.window_gap).nonzero()[0] + 1])
+        end = numpy.append(start[1:], len(ys))
+
+        if len(start) > self.window_maxcount:
+            return None
+
+        windows = []
+        area = 0
+        for s, e in zip(start, end):
+            sel = arg[s:e]
+            y0, y1 = ys[s], ys[e - 1] + 1
+            x0, x1 = x[sel].min(), x[sel].max() + 1
+            area += (y1 - y0) * (x1 - x0)
+            windows.append((sel, (y0, y1), (x0, x1)))
+
+        if area > self.window_maxfraction * shape[0] * shape[1]:
+            return None
+        return windows
         
     def metadata(self, brick, **kwargs):
         """ 
@@ -90,13 +458,171 @@ class ImageRepo(object):
         -------
         metadata : dict
             the metadata as a dictionary. Currently this is the
-            FITS header
+            FITS header, or the items of METADATA_DTYPE if the brick
+            is in the metadata store.
+
+        Notes
+        -----
+        An entry of the metadata store is used only if the modification
+        time of the image file matches the store; otherwise the header
+        is read. Each image is checked once, since the metadata is cached.
+        Use :py:meth:`build_metastore` to update the store.
         """
         if brick not in self.meta_cache:
-            meta = fits.read_metadata(self.get_filename(brick, **kwargs), hdu=self.image_hdu)
+            meta = None
+            if not kwargs:
+                meta = self._lookup_metastore(brick)
+            if meta is None:
+                meta = fits.read_metadata(self.get_filename(brick, **kwargs), hdu=self.image_hdu)
             self.meta_cache[brick] = meta
         return self.meta_cache[brick]
 
+    def _metastore_filename(self):
+        return os.path.join(self.metastore, self.name + '.npy')
+
+    def _load_metastore(self):
+        """ The metadata store, sorted by BRICK; empty if it does not exist. """
+        if self._metastore is None:
+            store = numpy.zeros(0, dtype=METADATA_DTYPE)
+            if self.metastore is not None and self.name is not None:
+                try:
+                    store = numpy.load(self._metastore_filename())
+                except IOError:
+                    pass
+            self._metastore = store
+        return self._metastore
+
+    def _lookup_metastore(self, brick):
+        """ Metadata of brick in the metadata store, or None if it is not
+            in the store or the image file has changed since it was stored.
+        """
+        store = self._load_metastore()
+        i = store['BRICK'].searchsorted(brick.index)
+        if i == len(store) or store['BRICK'][i] != brick.index:
+            return None
+        row = store[i]
+        try:
+            mtime = os.stat(self.get_filename(brick)).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != row['MTIME']:
+            # fall back to reading the header.
+            return None
+        meta = {}
+        for name in METADATA_DTYPE.names:
+            value = row[name]
+            if isinstance(value, bytes):
+                value = value.decode()
+            elif isinstance(value, numpy.generic):
+                value = value.item()
+            meta[name] = value
+        return meta
+
+    def build_metastore(self, bricks, workers=1):
+        """
+        Build or update the metadata store for bricks.
+
+        Entries of images that are not modified since they were
+        stored are kept; other headers are read again.
+        Bricks without an image are not stored.
+
+        Parameters
+        ----------
+        bricks : list, :py:class:`~model.brick.Brick`
+            the bricks, e.g. a :py:class:`~model.brickset.BrickSet`.
+        workers : int or None
+            number of threads to read the headers with;
+            None for the number of CPUs.
+
+        Returns
+        -------
+        nupdated : int
+            number of headers that are read.
+        """
+        self._metastore = None
+        old = self._load_metastore()
+        bricks = list(bricks)
+        store = numpy.zeros(len(bricks), dtype=METADATA_DTYPE)
+        found = numpy.zeros(len(bricks), dtype='?')
+        updated = numpy.zeros(len(bricks), dtype='?')
+
+        def work(i):
+            brick = bricks[i]
+            fname = self.get_filename(brick)
+            try:
+                mtime = os.stat(fname).st_mtime
+            except OSError:
+                return
+            found[i] = True
+            j = old['BRICK'].searchsorted(brick.index)
+            if j < len(old) and old['BRICK'][j] == brick.index \
+                and old['MTIME'][j] == mtime:
+                store[i] = old[j]
+                return
+            meta = fits.read_metadata(fname, hdu=self.image_hdu)
+            shape = _image_shape(meta)
+            row = store[i:i+1]
+            for name in METADATA_DTYPE.names:
+                if name in meta:
+                    row[name] = meta[name]
+            row['NAXIS2'], row['NAXIS1'] = shape
+            row['BRICK'] = brick.index
+            row['MTIME'] = mtime
+            updated[i] = True
+
+        dirscan.threadmap(work, range(len(bricks)), nthreads=workers)
+
+        store = store[found]
+        store = store[store['BRICK'].argsort()]
+        if not _savenpy(self._metastore_filename(), store):
+            raise IOError("cannot write to %s" % self._metastore_filename())
+        self._metastore = store
+        return updated.sum()
+
+    def wcs_table(self, bricks, workers=1):
+        """
+        Build a table of the WCS of the images of bricks.
+
+        The headers are read without adding them to the metadata cache.
+        Rows of bricks without an image have VALID set to False.
+
+        Parameters
+        ----------
+        bricks : list, :py:class:`~model.brick.Brick`
+            the bricks, e.g. a :py:class:`~model.brickset.BrickSet`.
+        workers : int or None
+            number of threads to read the headers with;
+            None for the number of CPUs.
+
+        Returns
+        -------
+        table : array_like
+            of dtype WCS_TABLE_DTYPE, in the order of bricks. CD, CRPIX
+            and CRVAL are arguments of :py:meth:`~utils.wcs_tangent.ang2pix`,
+            with zero offset pixels; SHAPE is (ny, nx); MTIME is the
+            modification time of the image file.
+        """
+        bricks = list(bricks)
+        table = numpy.zeros(len(bricks), dtype=WCS_TABLE_DTYPE)
+
+        def work(i):
+            brick = bricks[i]
+            table['BRICK'][i] = brick.index
+            fname = self.get_filename(brick)
+            if not self.exists(brick):
+                return
+            table['MTIME'][i] = os.stat(fname).st_mtime
+            meta = fits.read_metadata(fname, hdu=self.image_hdu)
+            cd, crpix, crval = wcs_tangent.parse_header(meta, zero_offset=True)
+            table['CD'][i] = cd
+            table['CRPIX'][i] = crpix
+            table['CRVAL'][i] = crval
+            table['SHAPE'][i] = _image_shape(meta)
+            table['VALID'][i] = True
+
+        dirscan.threadmap(work, range(len(bricks)), nthreads=workers)
+        return table
+
     def get_filename(self, brick, **kwargs):
         """ 
         Generate a filename.
@@ -107,6 +633,7 @@ class ImageRepo(object):
         -----
         We also try to generate
         a .gz filename, if the original filename does not exist.
+        The manifest is used if the brick is in it.
 
         Parameters
         ----------
@@ -114,6 +641,33 @@ class ImageRepo(object):
             the brick whose filename will be generated.
          
         """
+        fn = self._format_filename(brick, **kwargs)
+        if not kwargs:
+            variant = self._lookup_manifest(brick)
+            if variant == FILE_GZ:
+                return fn + '.gz'
+            if variant is not None:
+                return fn
+        if not os.path.exists(fn):
+            fngz = fn + '.gz' 
+            if os.path.exists(fngz):
+                return fngz
+        return fn
+
+    def exists(self, brick, **kwargs):
+        """
+        True if the image file of a brick exists.
+
+        The manifest is used if the brick is in it.
+        """
+        if not kwargs:
+            variant = self._lookup_manifest(brick)
+            if variant is not None:
+                return variant != FILE_MISSING
+        return os.path.exists(self.get_filename(brick, **kwargs))
+
+    def _format_filename(self, brick, **kwargs):
+        """ Filename of a brick from the pattern, without the .gz fallback. """
         if hasattr(self.pattern, '__call__'):
             fn = os.path.join(self.root, 
                 self.pattern(brick, **kwargs))
@@ -122,9 +676,109 @@ class ImageRepo(object):
             kwargs['brickname'] = brick.name
             fn = os.path.join(self.root, 
                 self.pattern) % kwargs
-        if not os.path.exists(fn):
-            fngz = fn + '.gz' 
-            if os.path.exists(fngz):
-                return fngz
         return fn
 
+    def _manifest_filename(self):
+        return os.path.join(self.manifest, self.name + '.npy')
+
+    def _load_manifest(self):
+        """ The manifest, sorted by BRICK; empty if it does not exist. """
+        if self._manifest is None:
+            manifest = numpy.zeros(0, dtype=MANIFEST_DTYPE)
+            if self.manifest is not None and self.name is not None:
+                try:
+                    manifest = numpy.load(self._manifest_filename())
+                except IOError:
+                    pass
+            self._manifest = manifest
+        return self._manifest
+
+    def _lookup_manifest(self, brick):
+        """ Variant of the image file of brick in the manifest, or None. """
+        manifest = self._load_manifest()
+        i = manifest['BRICK'].searchsorted(brick.index)
+        if i == len(manifest) or manifest['BRICK'][i] != brick.index:
+            return None
+        return manifest['VARIANT'][i]
+
+    def build_manifest(self, bricks, files, scanned):
+        """
+        Build the manifest of image files for bricks.
+
+        Parameters
+        ----------
+        bricks : list, :py:class:`~model.brick.Brick`
+            the bricks, e.g. a :py:class:`~model.brickset.BrickSet`.
+        files : set
+            the files that exist under the scanned directory, relative
+            to root; at least those of bricks.
+        scanned : string
+            the scanned directory, relative to root, e.g. 'coadd'.
+            Bricks whose image file is not under it are not added
+            to the manifest.
+
+        Returns
+        -------
+        manifest : array_like
+            of MANIFEST_DTYPE, sorted by BRICK.
+        """
+        bricks = list(bricks)
+        manifest = numpy.zeros(len(bricks), dtype=MANIFEST_DTYPE)
+        known = numpy.zeros(len(bricks), dtype='?')
+        for i, brick in enumerate(bricks):
+            fn = os.path.relpath(self._format_filename(brick), self.root)
+            if not fn.startswith(os.path.join(scanned, '')):
+                continue
+            manifest['BRICK'][i] = brick.index
+            if fn in files:
+                manifest['VARIANT'][i] = FILE_PLAIN
+            elif fn + '.gz' in files:
+                manifest['VARIANT'][i] = FILE_GZ
+            known[i] = True
+
+        manifest = manifest[known]
+        manifest = manifest[manifest['BRICK'].argsort()]
+        if not _savenpy(self._manifest_filename(), manifest):
+            raise IOError("cannot write to %s" % self._manifest_filename())
+        self._manifest = manifest
+        return manifest
+
+if __name__ == '__main__':
+    # self test: an entry of the metadata store is not used once the
+    # image file is rewritten.
+    import tempfile
+    import shutil
+    import fitsio
+    from .brick import Brick
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        brick = Brick(0, 1, '0001p000', 0.125, 0., 0., 0.25, -0.125, 0.125)
+        fname = os.path.join(tmpdir, 'image-0001p000.fits')
+
+        def write(crval1, mtime):
+            header = dict(CTYPE1='RA---TAN', CTYPE2='DEC--TAN', CRVAL1=crval1, CRVAL2=0.,
+                CRPIX1=5.5, CRPIX2=5.5, CD1_1=-0.025, CD1_2=0., CD2_1=0., CD2_2=0.025)
+            fitsio.write(fname, numpy.zeros((10, 10), 'f4'), header=header, clobber=True)
+            os.utime(fname, (mtime, mtime))
+
+        def make_repo():
+            return ImageRepo(tmpdir, lambda b: 'image-%s.fits' % b.name, 0,
+                    name='image', metastore=os.path.join(tmpdir, 'meta'))
+
+        write(0.125, 1000000000.)
+        assert make_repo().build_metastore([brick]) == 1
+        meta = make_repo().metadata(brick)
+        assert meta['MTIME'] == 1000000000. and meta['CRVAL1'] == 0.125
+
+        # a later modification time than the store.
+        write(0.25, 1000000010.)
+        meta = make_repo().metadata(brick)
+        assert 'MTIME' not in meta and meta['CRVAL1'] == 0.25
+
+        assert make_repo().build_metastore([brick]) == 1
+        meta = make_repo().metadata(brick)
+        assert meta['MTIME'] == 1000000010. and meta['CRVAL1'] == 0.25
+    finally:
+        shutil.rmtree(tmpdir)
+    print('metastore: ok')
@@ -10,9 +10,22 @@
 """
 import re
 import os.path
+import numpy
 
 class Schema:
-    pass
+    @classmethod
+    def parse_filenames(kls, filenames, brickindex):
+        """ Returns the internal indices of bricks for a list of 
+            catalogue filenames. Filenames that are not catalogues
+            are skipped.
+        """
+        bid = []
+        for filename in filenames:
+            try:
+                bid.append(kls.parse_filename(filename, brickindex))
+            except ValueError:
+                pass
+        return numpy.array(bid, dtype='i8')
 
 class EDR(Schema):
     """ Schema for EDR.
@@ -87,6 +100,23 @@ class EDR3(Schema):
         bid = brickindex.search_by_name(brickname)
         return bid
 
+    @staticmethod
+    def parse_filenames(filenames, brickindex):
+        """ Vectorized version of parse_filename. The brick names are
+            looked up with a single call to
+            :py:meth:`~model.brickindex.BrickIndex.search_by_name`;
+            filenames that are not catalogues are skipped.
+        """
+        filenames = numpy.asarray(filenames, dtype='U')
+        if len(filenames) == 0:
+            return numpy.array([], dtype='i8')
+        basenames = numpy.char.rpartition(filenames, '/')[..., 2]
+        basenames = basenames[numpy.char.endswith(basenames, '.fits')]
+        bricknames = numpy.char.partition(
+                     numpy.char.partition(basenames, '-')[..., 2], '.')[..., 0]
+        bid, missing = brickindex.search_by_name(bricknames, return_missing=True)
+        return numpy.array(bid[~missing], dtype='i8')
+
 class EDR4(EDR3):
     """ Schema for EDR4.
         Changed to DECAM_MW_TRANSMISSION
@@ -0,0 +1,91 @@
+"""
+    Routines to scan directory trees with threads.
+
+    On parallel file systems the latency of listing a directory
+    dominates; scanning several directories at the same time with
+    threads hides most of it.
+
+"""
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+__all__ = ['listdir', 'walk', 'threadmap']
+
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+def listdir(path):
+    """
+    List a directory.
+
+    Symbolic links are followed.
+
+    Returns
+    -------
+    files : list
+        names of the files in path.
+    dirs  : list
+        names of the directories in path.
+    """
+    files = []
+    dirs = []
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                dirs.append(name)
+            else:
+                files.append(name)
+    return files, dirs
+
+def walk(path):
+    """
+    List all files under path, following symbolic links.
+
+    Returns
+    -------
+    files : list
+        paths of the files, relative to path.
+    """
+    result = []
+    stack = ['']
+    while len(stack) > 0:
+        rel = stack.pop()
+        files, dirs = listdir(os.path.join(path, rel))
+        result.extend([os.path.join(rel, f) for f in files])
+        stack.extend([os.path.join(rel, d) for d in dirs])
+    return result
+
+def threadmap(func, items, nthreads=None):
+    """
+    Apply func to items with a pool of threads.
+
+    Parameters
+    ----------
+    nthreads : int or None
+        number of threads; None for the number of CPUs.
+
+    Returns
+    -------
+    results : list
+        func(item) for each of items, in the same order.
+    """
+    items = list(items)
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    nthreads = max(min(nthreads, len(items)), 1)
+    if nthreads == 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(nthreads)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -1,5 +1,21 @@
 from numpy import *
 
+def _constants(fk4=False):
+   """ The constants (psi, stheta, ctheta, phi) of the transformations
+       of :py:func:`euler`, indexed by SELECT - 1.
+   """
+   if fk4:   
+      psi = array ([0.57595865315e0, 4.9261918136e0, 0.00000000000e0, 0.0000000000e0, 0.11129056012e0, 4.7005372834e0])
+      stheta = array ([0.88781538514e0, -0.88781538514e0, 0.39788119938e0, -0.39788119938e0, 0.86766174755e0, -0.86766174755e0])
+      ctheta = array([0.46019978478e0, 0.46019978478e0, 0.91743694670e0, 0.91743694670e0, 0.49715499774e0, 0.49715499774e0])
+      phi = array([4.9261918136e0, 0.57595865315e0, 0.0000000000e0, 0.00000000000e0, 4.7005372834e0, 0.11129056012e0])
+   else:   
+      psi = array([0.57477043300e0, 4.9368292465e0, 0.00000000000e0, 0.0000000000e0, 0.11142137093e0, 4.71279419371e0])
+      stheta = array([0.88998808748e0, -0.88998808748e0, 0.39777715593e0, -0.39777715593e0, 0.86766622025e0, -0.86766622025e0])
+      ctheta = array([0.45598377618e0, 0.45598377618e0, 0.91748206207e0, 0.91748206207e0, 0.49714719172e0, 0.49714719172e0])
+      phi = array([4.9368292465e0, 0.57477043300e0, 0.0000000000e0, 0.00000000000e0, 4.71279419371e0, 0.11142137093e0])
+   return psi, stheta, ctheta, phi
+
 def euler(ai, bi, select=1, fk4=False):
    """
     Transform between Galactic, celestial, and ecliptic coordinates.
@@ -76,16 +92,9 @@ def euler(ai, bi, select=1, fk4=False):
    
    if fk4:   
       equinox = '(B1950)'
-      psi = array ([0.57595865315e0, 4.9261918136e0, 0.00000000000e0, 0.0000000000e0, 0.11129056012e0, 4.7005372834e0])
-      stheta = array ([0.88781538514e0, -0.88781538514e0, 0.39788119938e0, -0.39788119938e0, 0.86766174755e0, -0.86766174755e0])
-      ctheta = array([0.46019978478e0, 0.46019978478e0, 0.91743694670e0, 0.91743694670e0, 0.49715499774e0, 0.49715499774e0])
-      phi = array([4.9261918136e0, 0.57595865315e0, 0.0000000000e0, 0.00000000000e0, 4.7005372834e0, 0.11129056012e0])
    else:   
       equinox = '(J2000)'
-      psi = array([0.57477043300e0, 4.9368292465e0, 0.00000000000e0, 0.0000000000e0, 0.11142137093e0, 4.71279419371e0])
-      stheta = array([0.88998808748e0, -0.88998808748e0, 0.39777715593e0, -0.39777715593e0, 0.86766622025e0, -0.86766622025e0])
-      ctheta = array([0.45598377618e0, 0.45598377618e0, 0.91748206207e0, 0.91748206207e0, 0.49714719172e0, 0.49714719172e0])
-      phi = array([4.9368292465e0, 0.57477043300e0, 0.0000000000e0, 0.00000000000e0, 4.71279419371e0, 0.11142137093e0])
+   psi, stheta, ctheta, phi = _constants(fk4)
       
    i = select - 1                         # IDL offset
    a = ai / deg_to_rad - phi[i]
@@ -99,3 +108,156 @@ def euler(ai, bi, select=1, fk4=False):
    ao = ((a + psi[i] + fourpi) % twopi) * deg_to_rad
 
    return (ao,bo)
+
+# rotation matrices of the transformations, by (select, fk4).
+_matrices = {}
+
+def euler_matrix(select=1, fk4=False):
+   """
+    The rotation matrix of a transformation of :py:func:`euler`.
+
+    The matrix is computed once for each transformation and cached.
+
+    Parameters
+    ----------
+    SELECT : integer (1-6), optional
+        Specifying type of coordinate transformation; see :py:func:`euler`.
+    FK4 : boolean
+        If True, celestial and ecliptic coordinates are in equinox B1950.
+
+    Returns
+    -------
+    M : array_like (3, 3)
+        rotating the unit vectors of the input coordinates to those of
+        the output coordinates. Do not modify.
+   """
+   key = (select, bool(fk4))
+   if key not in _matrices:
+      # euler rotates by -phi around the z axis, then by theta around
+      # the x axis, then by psi around the z axis. theta is recomputed
+      # from stheta and ctheta such that M is orthonormal.
+      psi, stheta, ctheta, phi = _constants(fk4)
+      i = select - 1
+      theta = arctan2(stheta[i], ctheta[i])
+      ct, st = cos(theta), sin(theta)
+      cp, sp = cos(psi[i]), sin(psi[i])
+      cf, sf = cos(phi[i]), sin(phi[i])
+      Rpsi = array([[cp, -sp, 0.], [sp, cp, 0.], [0., 0., 1.]])
+      Rtheta = array([[1., 0., 0.], [0., ct, st], [0., -st, ct]])
+      Rphi = array([[cf, sf, 0.], [-sf, cf, 0.], [0., 0., 1.]])
+      M = dot(Rpsi, dot(Rtheta, Rphi))
+      M.flags.writeable = False
+      _matrices[key] = M
+   return _matrices[key]
+
+def rotate(ai, bi, select=1, fk4=False, chunksize=65536):
+   """
+    Transform between Galactic, celestial, and ecliptic coordinates
+    in single precision, with a rotation of unit vectors.
+
+    This is several times faster than :py:func:`euler` and uses less
+    memory: the rotation matrix is cached, and the points are rotated
+    in chunks of float32. The error is about 4e-5 degrees. In double
+    precision a rotation is not faster than :py:func:`euler`;
+    use :py:func:`euler` instead.
+
+    Parameters
+    ----------
+    AI : array_like
+        Input Longitude in DEGREES.
+    BI : array_like 
+        Input Latitude in DEGREES.
+    SELECT : integer (1-6), optional
+        Specifying type of coordinate transformation; see :py:func:`euler`.
+    FK4 : boolean
+        If True, celestial and ecliptic coordinates are in equinox B1950.
+    CHUNKSIZE : int
+        number of points to rotate at a time.
+
+    Returns
+    -------
+    AO : array_like, float32
+        Output Longitude in DEGREES, between 0 and 360.
+    BO : array_like, float32
+        Output Latitude in DEGREES
+   """
+   dtype = 'f4'
+   M = euler_matrix(select, fk4).astype(dtype)
+   ai, bi = broadcast_arrays(asarray(ai), asarray(bi))
+   shape = ai.shape
+   ai = ai.ravel()
+   bi = bi.ravel()
+
+   ao = empty(len(ai), dtype=dtype)
+   bo = empty(len(ai), dtype=dtype)
+
+   n = chunksize if len(ai) > chunksize else len(ai)
+   a = empty(n, dtype=dtype)
+   b = empty(n, dtype=dtype)
+   cb = empty(n, dtype=dtype)
+   v = empty((3, n), dtype=dtype)
+   r = empty((3, n), dtype=dtype)
+
+   for start in range(0, len(ai), chunksize):
+      end = start + n if start + n < len(ai) else len(ai)
+      m = end - start
+      a1, b1, cb1, v1, r1 = a[:m], b[:m], cb[:m], v[:, :m], r[:, :m]
+
+      radians(ai[start:end], out=a1)
+      radians(bi[start:end], out=b1)
+      cos(b1, out=cb1)
+      cos(a1, out=v1[0])
+      v1[0] *= cb1
+      sin(a1, out=v1[1])
+      v1[1] *= cb1
+      sin(b1, out=v1[2])
+
+      if m == n:
+         dot(M, v1, out=r1)
+      else:
+         r1[...] = dot(M, v1)
+
+      arctan2(r1[1], r1[0], out=a1)
+      degrees(a1, out=a1)
+      add(a1, 360., out=a1, where=a1 < 0)
+      ao[start:end] = a1
+      # arctan2 is accurate near the poles, unlike arcsin.
+      multiply(r1[0], r1[0], out=cb1)
+      multiply(r1[1], r1[1], out=b1)
+      cb1 += b1
+      sqrt(cb1, out=cb1)
+      arctan2(r1[2], cb1, out=b1)
+      degrees(b1, out=bo[start:end])
+
+   return ao.reshape(shape), bo.reshape(shape)
+
+if __name__ == '__main__':
+   # benchmark rotate against euler on 1e8 points.
+   import time
+   import sys
+
+   N = int(float(sys.argv[1])) if len(sys.argv) > 1 else 100000000
+   batch = 1000000
+   rng = random.RandomState(1234)
+
+   t = dict(euler=0., rotate=0.)
+   err = 0.
+   for start in range(0, N, batch):
+      m = batch if start + batch < N else N - start
+      ra = rng.uniform(0, 360., size=m)
+      dec = degrees(arcsin(rng.uniform(-1, 1., size=m)))
+
+      t0 = time.time()
+      l, b = euler(ra, dec, 1)
+      t['euler'] += time.time() - t0
+      t0 = time.time()
+      l1, b1 = rotate(ra, dec, 1)
+      t['rotate'] += time.time() - t0
+      # the angular separation, in degrees.
+      dl = abs((l1 - l + 180.) % 360. - 180.) * cos(radians(b))
+      err = amax([err, amax(dl), amax(abs(b1 - b))])
+
+   print('%d points' % N)
+   print('euler  : %8.3f s %8.3g points/s' % (t['euler'], N / t['euler']))
+   print('rotate : %8.3f s %8.3g points/s; max error %g degrees'
+         % (t['rotate'], N / t['rotate'], err))
@@ -32,16 +32,21 @@ def use_astropy():
 
     from astropy.io import fits
 
-    def read_image(filename, hdu=0):
+    def read_image(filename, hdu=0, subset=None):
         """
             Read the zeroth image HDU from a fits file
 
+            subset is ((ystart, yend), (xstart, xend)) to read only
+            a window of the image.
         """
         file = fits.open(filename)
         #    A copy of data is made before the file object
         #    is dereferenced. This is to ensure no back references
         #    to the fits object and file gets closed in a timely
         #    fashion.
+        if subset is not None:
+            (y0, y1), (x0, x1) = subset
+            return numpy.array(file[hdu].section[y0:y1, x0:x1], copy=True)
         return numpy.array(file[hdu].data, copy=True)
 
     def read_table(filename, hdu=1, subset=None):
@@ -80,16 +85,22 @@ def use_fitsio():
 
     from fitsio import FITS
 
-    def read_image(filename, hdu=0):
+    def read_image(filename, hdu=0, subset=None):
         """
             Read the zeroth image HDU from a fits file
 
+            subset is ((ystart, yend), (xstart, xend)) to read only
+            a window of the image. Only the tiles of a tile compressed
+            image that overlap the window are decompressed.
         """
         file = FITS(filename, upper=True)
         #    A copy of data is made before the file object
         #    is dereferenced. This is to ensure no back references
         #    to the fits object and file gets closed in a timely
         #    fashion.
+        if subset is not None:
+            (y0, y1), (x0, x1) = subset
+            return numpy.array(file[hdu][y0:y1, x0:x1], copy=True)
         return numpy.array(file[hdu].read(), copy=True)
 
     def read_table(filename, hdu=1, subset=None):
@@ -0,0 +1,68 @@
+"""
+    Sharing read-only arrays between the MPI ranks on a node
+    with MPI-3 shared memory windows.
+
+    One rank per node holds the array in a shared memory window;
+    the other ranks of the node map the same memory. Requires mpi4py.
+
+"""
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+__all__ = ['share']
+
+import numpy
+
+# the windows must outlive the arrays that use their memory.
+_windows = []
+
+def share(comm, array):
+    """
+    Share an array between the ranks of comm on the same node.
+
+    Parameters
+    ----------
+    comm : MPI.Comm
+        the communicator, e.g. MPI.COMM_WORLD.
+    array : array_like or callable
+        the array on the first rank of each node; it is ignored on the
+        other ranks. If callable, it is called to create the array
+        only on the first rank of each node.
+
+    Returns
+    -------
+    shared : array_like
+        a read-only array in the shared memory of the node.
+
+    """
+    from mpi4py import MPI
+
+    node = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    try:
+        if node.rank == 0:
+            if callable(array):
+                array = array()
+            array = numpy.asarray(array)
+            header = (array.shape, array.dtype)
+        else:
+            header = None
+        shape, dtype = node.bcast(header)
+
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        if node.rank != 0:
+            nbytes = 0
+
+        win = MPI.Win.Allocate_shared(max(nbytes, 1), 1, comm=node)
+        _windows.append(win)
+
+        buf, itemsize = win.Shared_query(0)
+        shared = numpy.ndarray(buffer=buf, dtype=dtype, shape=shape)
+        if node.rank == 0:
+            shared[...] = array
+        node.Barrier()
+    finally:
+        node.Free()
+
+    shared.flags.writeable = False
+    return shared
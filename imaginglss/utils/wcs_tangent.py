@@ -19,7 +19,7 @@ from __future__ import print_function
 __author__ = "Yu Feng and Martin White"
 __version__ = "0.9"
 __email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
-__all__ = ['ang2pix','pix2ang','ang2pix_hdr','pix2ang_hdr']
+__all__ = ['ang2pix','pix2ang','ang2pix_hdr','pix2ang_hdr','ang2pix_indexed']
 
 
 
@@ -165,8 +165,58 @@ def ang2pix(coord,CD,CRPIX,CRVAL):
     xy += numpy.array(CRPIX).reshape(2, -1)
     return xy.reshape(coord.shape)
     #
-def native_transform(native_longpole, native_latpole, longitude, latitude, inverted=False):
-    
+
+def ang2pix_indexed(coord,index,CD,CRPIX,CRVAL):
+    """
+    Convert RA, DEC to x,y, with a TAN transformation per point,
+    selected from a table of transformations.
+
+    The inverse of CD and the rotation matrix are computed once per
+    row of the table, rather than once per point as
+    in :py:meth:`ang2pix`.
+
+    Parameters
+    ----------
+    coord : array_like
+        coord = (RA, DEC), RA and DEC (in decimal degrees, vectorized) 
+    index : array_like
+        the row of the table for each point.
+    CD    : array_like
+        transformation matrices (4, M)
+    CRPIX : array_like
+        center pixel numbers of (x, y), (2, M), compensated by offset.
+    CRVAL : array_like
+        center coordinates of (RA, DEC), (2, M), in degrees.
+
+    """
+    coord = numpy.array(coord, dtype='f8')
+    view = coord.reshape(2, -1)
+    index = numpy.asarray(index).reshape(-1)
+    CRVAL = numpy.array(CRVAL, dtype='f8').reshape(2, -1)
+    CRPIX = numpy.array(CRPIX, dtype='f8').reshape(2, -1)
+
+    matrix = numpy.linalg.inv(numpy.array(CD, dtype='f8').reshape(2, 2, -1).transpose((2, 0, 1)))
+    r = rotation_matrix(CRVAL[0], CRVAL[1])
+
+    ra, dec = rotate(r[index], view[0], view[1], inverted=False)
+
+    ra *= numpy.pi / 180.
+    dec *= numpy.pi / 180.
+
+    xy    = numpy.empty_like(view)
+    rdiv = 180. / numpy.pi / numpy.tan(dec)
+    xy[0] = rdiv * numpy.sin(ra)
+    xy[1] = -rdiv * numpy.cos(ra)
+
+    xy = numpy.einsum('imn,ni->mi', matrix[index], xy)
+    xy += CRPIX[:, index]
+    return xy.reshape(coord.shape)
+
+def rotation_matrix(native_longpole, native_latpole):
+    """
+    Rotation matrices from the standard system to the native system of
+    the projections, (M, 3, 3); see :py:meth:`native_transform`.
+    """
     longpole = 180.
     d2r = numpy.pi / 180.
     # If Theta0 = 90 then CRVAL gives the coordinates of the origin in the
@@ -192,8 +242,17 @@ def native_transform(native_longpole, native_latpole, longitude, latitude, inver
                      [ ca*sp - sa*cp*sd , -ca*cp - sa*sp*sd, sa*cd ] ,
                      [ cp*cd           ,   sp*cd           , sd    ] ],
                     dtype='f8').transpose((2, 1, 0))
+    return r
 
-    
+def native_transform(native_longpole, native_latpole, longitude, latitude, inverted=False):
+    r = rotation_matrix(native_longpole, native_latpole)
+    return rotate(r, longitude, latitude, inverted)
+
+def rotate(r, longitude, latitude, inverted=False):
+    """
+    Rotate longitude and latitude, in degrees, with rotation matrices r
+    from :py:meth:`rotation_matrix`, one per point or one for all points.
+    """
     latitude = latitude * (numpy.pi / 180)
     longitude = longitude * (numpy.pi / 180)
     x = numpy.cos(latitude)*numpy.cos(longitude)
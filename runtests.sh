@@ -1,10 +1,20 @@
+python -m imaginglss.model.brickindex || exit 1
+python -m imaginglss.model.imagerepo || exit 1
+python -m imaginglss.model.sfdmap || exit 1
+
 
 python scripts/imglss-build-cache.py --conf=testdata/dr3-mini/dr3.conf.py || exit 1
+# the E(B-V) table is built once and read from the cache afterwards; requires healpy.
+if python -c "import healpy" 2>/dev/null; then
+python scripts/imglss-build-cache.py --conf=testdata/dr3-mini/dr3.conf.py --sfd-nside=64 || exit 1
+python scripts/imglss-build-cache.py --conf=testdata/dr3-mini/dr3.conf.py --sfd-nside=64 | grep "reading E(B-V) table" || exit 1
+fi
 
 python scripts/imglss-mpi-select-objects.py --conf=testdata/dr3-mini/dr3.conf.py LRG LRG.hdf5|| exit 1
 
 python scripts/imglss-mpi-make-random.py --conf=testdata/dr3-mini/dr3.conf.py 10000 LRG-random.hdf5 || exit 1
 python scripts/imglss-mpi-query-depth.py --conf=testdata/dr3-mini/dr3.conf.py LRG-random.hdf5 || exit 1
+mpirun -n 2 python scripts/imglss-mpi-query-depth.py --shared-memory --conf=testdata/dr3-mini/dr3.conf.py LRG-random.hdf5 || exit 1
 
 python scripts/imglss-query-tycho-veto.py --conf=testdata/dr3-mini/dr3.conf.py LRG.hdf5 || exit 1
 python scripts/imglss-query-tycho-veto.py --conf=testdata/dr3-mini/dr3.conf.py LRG-random.hdf5 || exit 1
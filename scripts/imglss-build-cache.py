@@ -18,6 +18,16 @@ from imaginglss.cli import CLI
 from imaginglss.analysis import cache
 
 ap = CLI("Build cache")
+ap.add_argument("--rescan-bricks", action='store_true', default=False,
+        help="rescan the tractor directory for new bricks")
+ap.add_argument("--wcs-tables", action='store_true', default=False,
+        help="build the WCS tables of the depth and nexp images")
+ap.add_argument("--manifest", action='store_true', default=False,
+        help="scan the coadd directory and build the manifests of image files")
+ap.add_argument("--metadata", action='store_true', default=False,
+        help="build or update the metadata store of the depth and nexp images")
+ap.add_argument("--sfd-nside", type=int, default=None,
+        help="build the HEALPix table of E(B-V) at this nside and report its accuracy")
 
 ns = ap.parse_args()
 
@@ -25,6 +35,40 @@ decals = DECALS(ns.conf)
 print('building brick index')
 dr = decals.datarelease
 
+if ns.rescan_bricks:
+    print('rescanning covered bricks')
+    dr.refresh_footprint()
+
+if ns.manifest:
+    print('building manifests of image files')
+    n = dr.build_file_manifest()
+    print(n, 'files found')
+
+if ns.wcs_tables:
+    for image in ['depth', 'nexp']:
+        if image not in dr.images: continue
+        for band in sorted(dr.images[image]):
+            print('building WCS table of', image, band)
+            dr.build_wcs_table(dr.images[image][band])
+
+if ns.metadata:
+    for image in ['depth', 'nexp']:
+        if image not in dr.images: continue
+        for band in sorted(dr.images[image]):
+            print('building metadata store of', image, band)
+            n = dr.images[image][band].build_metastore(dr.footprint.bricks, workers=None)
+            print(n, 'headers are read')
+
+if ns.sfd_nside is not None:
+    if dr.sfdmap.has_table(ns.sfd_nside):
+        print('reading E(B-V) table at nside', ns.sfd_nside, 'from the cache')
+    else:
+        print('building E(B-V) table at nside', ns.sfd_nside)
+    dr.sfdmap.get_table(ns.sfd_nside)
+    report = dr.sfdmap.table_accuracy(ns.sfd_nside)
+    print('pixel size %(resolution)g arcmin; error of E(B-V) on %(npoints)d points:' % report)
+    print('max %(max)g, rms %(rms)g, 99%% %(quantile99)g, max relative %(max_relative)g' % report)
+
 print('building tractor cache')
 builder = cache.CacheBuilder(decals.sweep_dir, decals.cache_dir, dr.schema.CATALOGUE_COLUMNS)
 
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Code to build the pixel cache of images
+#
+# Usage: mpirun python imglss-mpi-build-pixel-cache.py
+#
+from __future__ import print_function
+
+__author__ = "Yu Feng and Martin White"
+__version__ = "1.0"
+__email__  = "yfeng1@berkeley.edu or mjwhite@lbl.gov"
+
+from imaginglss import DECALS
+from imaginglss.cli import CLI
+
+cli = CLI("""
+Build the pixel cache of images of the bricks in the footprint.
+The decompressed images are stored as .npy files in decals_cache/pixels,
+where they are used if use_pixel_cache is set in the configuration file.
+With --pyramid, the block downsampled images for DataRelease.readout(resolution=...)
+are also built, in decals_cache/pyramid.
+Existing files that are newer than the images are kept.
+""")
+
+cli.add_argument("--images", nargs='+', default=['depth'], help="the images to cache, e.g. depth, image, model.")
+cli.add_argument("--bands", default='grz', help="the bands to cache.")
+cli.add_argument("--pyramid", action='store_true', default=False,
+        help="also build the block downsampled images, e.g. with --images depth nexp.")
+
+ns = cli.parse_args()
+decals = DECALS(ns.conf)
+decals.use_pixel_cache = True
+
+from mpi4py import MPI
+
+def build_pixel_cache(decals, ns, comm=MPI.COMM_WORLD):
+    dr = decals.datarelease
+    footprint = dr.footprint
+
+    nmissing = 0
+    nbricks = 0
+    for i in range(comm.rank, len(footprint.bricks), comm.size):
+        brick = footprint.bricks[i]
+        for image in ns.images:
+            for band in ns.bands:
+                repo = dr.images[image][band]
+                try:
+                    repo.open(brick)
+                    if ns.pyramid:
+                        repo.build_pyramid(brick)
+                except IOError:
+                    nmissing += 1
+        nbricks += 1
+        if nbricks % 100 == 0:
+            print(comm.rank, 'cached', nbricks, 'bricks')
+
+    nmissing = comm.allreduce(nmissing)
+    nbricks = comm.allreduce(nbricks)
+    if comm.rank == 0:
+        print('cached', nbricks, 'bricks;', nmissing, 'images are missing.')
+
+if __name__ == '__main__':
+    build_pixel_cache(decals, ns)
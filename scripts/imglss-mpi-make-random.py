@@ -22,56 +22,38 @@ from   imaginglss             import DECALS
 from imaginglss.cli import CLI
 
 cli = CLI("Generate Uniform Randoms in the footprint and query the depth.")
+cli.add_argument("--workers", type=int, default=1, help="number of threads per rank to read the depth images.")
+cli.add_argument("--shared-memory", action='store_true', default=False, help="keep one copy of the brick index and the SFD maps per node in MPI-3 shared memory.")
+cli.add_argument("--image-cache-size", type=int, default=None, help="budget of the image cache per rank in MB; overrides image_cache_size of the configuration file.")
 cli.add_argument("--seed", type=int, help="random seed; the result is also affected by the number of ranks.", default=99934123)
 cli.add_argument("Nran", type=int, help="Minimum number of randoms")
 cli.add_argument("output", help="File to store the randoms. Will be created." )
 
 ns = cli.parse_args()
 decals = DECALS(ns.conf)
+if ns.image_cache_size is not None:
+    decals.image_cache_size = ns.image_cache_size * 1024 * 1024
 
 import numpy             as np
 from   imaginglss.model.datarelease import Footprint
 from   imaginglss.model import dataproduct
 from   mpi4py            import MPI
 
+if ns.shared_memory:
+    decals.comm = MPI.COMM_WORLD
+
 np.seterr(divide='ignore', invalid='ignore')
 
 def fill_random(footprint, Nran, rng):
     """
     Generate uniformly distributed points within the boundary that lie in
-    bricks.  We generate in the ra/dec area, then remove points not in any
-    bricks.  This hugely increases the memory efficiency for footprints,
-    like DR1, where the survey covers several disjoint patches of the sky.
+    bricks.  We generate the points brick by brick, with the number of points
+    per brick proportional to the area of the brick.  This is efficient for
+    footprints, like DR1, where the survey covers several disjoint patches of
+    the sky.
 
     """
-
-
-    coord = np.empty((2, Nran))
-
-    ramin,ramax,dcmin,dcmax,area = footprint.range
-
-    start = 0
-    while start != Nran:
-        # prepare for a parallel section.
-        chunksize = 1024 * 512
-        u1,u2= rng.uniform(size=(2, 1024 * 1024) )
-
-        #
-        cmin = np.sin(dcmin*np.pi/180)
-        cmax = np.sin(dcmax*np.pi/180)
-        #
-        RA   = ramin + u1*(ramax-ramin)
-        DEC  = 90-np.arccos(cmin+u2*(cmax-cmin))*180./np.pi
-        # Filter out those not in any bricks: only very few points remain 
-        coord1 = footprint.filter((RA, DEC))
-
-        # Are we full?
-        coord1 = coord1[:, :min(len(coord1.T), Nran - start)]
-        sl = slice(start, start + len(coord1.T))
-        coord[:, sl] = coord1
-        start = start + len(coord1.T)
-    
-    return coord
+    return footprint.random_sample(Nran, rng)
 
 
 def make_random(decals, ns, comm=MPI.COMM_WORLD):
@@ -113,7 +95,7 @@ def make_random(decals, ns, comm=MPI.COMM_WORLD):
 
     ns.Nran = sum(comm.allgather(len(coord[0])))
 
-    cat_lim = dr.read_depths(coord, 'grz')
+    cat_lim = dr.read_depths(coord, 'grz', workers=ns.workers)
 
     # It's also useful to the 1 sigma limits later.
     randoms['INTRINSIC_NOISELEVEL'][:, :6] = (cat_lim['DECAM_DEPTH'] ** -0.5 / cat_lim['DECAM_MW_TRANSMISSION'])
@@ -23,15 +23,23 @@ as the query input.
 
 """)
 
+cli.add_argument("--workers", type=int, default=1, help="number of threads per rank to read the depth images.")
+cli.add_argument("--shared-memory", action='store_true', default=False, help="keep one copy of the brick index and the SFD maps per node in MPI-3 shared memory.")
+cli.add_argument("--image-cache-size", type=int, default=None, help="budget of the image cache per rank in MB; overrides image_cache_size of the configuration file.")
 cli.add_argument("query", help="An HDF5 file with RA and DEC dataset, the position of to query the depth." )
 
 ns = cli.parse_args()
 decals = DECALS(ns.conf)
+if ns.image_cache_size is not None:
+    decals.image_cache_size = ns.image_cache_size * 1024 * 1024
 
 import numpy             as np
 from   imaginglss.model.datarelease import Footprint
 from   imaginglss.model import dataproduct
 from   mpi4py            import MPI
+
+if ns.shared_memory:
+    decals.comm = MPI.COMM_WORLD
 from   imaginglss.analysis    import cuts
 
 np.seterr(divide='ignore', invalid='ignore')
@@ -59,7 +67,7 @@ def query_depth(decals, ns, comm=MPI.COMM_WORLD):
 
     ns.Nran = sum(comm.allgather(len(coord[0])))
 
-    cat_lim = dr.read_depths(coord, 'grz')
+    cat_lim = dr.read_depths(coord, 'grz', workers=ns.workers)
 
     # It's also useful to the 1 sigma limits later.
     randoms['INTRINSIC_NOISELEVEL'][:, :6] = (cat_lim['DECAM_DEPTH'] ** -0.5 / cat_lim['DECAM_MW_TRANSMISSION'])
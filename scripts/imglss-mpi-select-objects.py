@@ -30,6 +30,9 @@ cli = CLI("Select Objects based on Target definitions", enable_target_plugins=Tr
 cli.add_argument("--use-depth-bricks", action='store_true', default=False, help="use tractor's brick depth in the catalogue, very slow!")
 cli.add_argument("--use-bigfile", action='store_true', default=False ,help='save as a bigfile; use bigfile-convert to convert afterwards')
 
+cli.add_argument("--workers", type=int, default=1, help="number of threads per rank to read the depth images.")
+cli.add_argument("--shared-memory", action='store_true', default=False, help="keep one copy of the brick index and the SFD maps per node in MPI-3 shared memory.")
+cli.add_argument("--image-cache-size", type=int, default=None, help="budget of the image cache per rank in MB; overrides image_cache_size of the configuration file.")
 cli.add_argument("--limit", type=int, default=None, help='limit to use this many candidates.')
 cli.add_target_type_argument("ObjectType")
 cli.add_argument("output", help="Output file name. A new object catalogue file will be created.")
@@ -37,9 +40,14 @@ cli.add_argument("output", help="Output file name. A new object catalogue file w
 ns = cli.parse_args()
 
 decals = DECALS(ns.conf)
+if ns.image_cache_size is not None:
+    decals.image_cache_size = ns.image_cache_size * 1024 * 1024
 
 from mpi4py import MPI
 
+if ns.shared_memory:
+    decals.comm = MPI.COMM_WORLD
+
 np.seterr(divide='ignore', invalid='ignore')
 
 def select_objs(decals, ns, comm=MPI.COMM_WORLD):
@@ -119,7 +127,7 @@ def select_objs(decals, ns, comm=MPI.COMM_WORLD):
             cat_lim['DECAM_DEPTH'][:, i] = cat[depth][mine][mask]
             cat_lim['DECAM_MW_TRANSMISSION'][:, i] = cat[mw][mine][mask]
     else:
-        cat_lim1 = dr.read_depths((targets['RA'], targets['DEC']), 'grz')
+        cat_lim1 = dr.read_depths((targets['RA'], targets['DEC']), 'grz', workers=ns.workers)
         cat_lim['DECAM_DEPTH'][:, i] = cat_lim1['DECAM_DEPTH']
         cat_lim['DECAM_MW_TRANSMISSION'][:, i] = cat_lim1['DECAM_MW_TRANSMISSION']
 
@@ -13,6 +13,7 @@ setup(name="imaginglss", version="0.1.0rc0",
       scripts = [
             'scripts/imglss-build-cache.py',
             'scripts/imglss-export-text.py',
+            'scripts/imglss-mpi-build-pixel-cache.py',
             'scripts/imglss-mpi-make-random.py',
             'scripts/imglss-mpi-query-depth.py',
             'scripts/imglss-mpi-select-objects.py',
@@ -22,6 +23,7 @@ setup(name="imaginglss", version="0.1.0rc0",
             'scripts/imglss-naive-crosscorrelation.py',
       ],
       install_requires=['numpy'],
+      extras_require={'healpix': ['healpy>=1.11']},
       requires=['bigfile'],
 )
 